@@ -0,0 +1,79 @@
+"""
+Compares the old nested-scan assembly of GET /api/inventory/ with the
+indexed assembly in util/catalog.py over synthetic catalogs of increasing size.
+
+Run from the root directory with: python benchmarks/catalog_assembly.py
+"""
+import copy
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from util.catalog import build_item_documents  # noqa: E402
+
+# (main items, children per main item, images per item row)
+CATALOG_SIZES = [(250, 3, 2), (500, 3, 2), (1_000, 3, 2), (2_500, 3, 2)]
+
+
+def create_catalog(main_count: int, children_per_item: int, images_per_row: int):
+    rows = []
+    images = []
+    child_id = 1
+
+    for item_id in range(1, main_count + 1):
+        for index in range(children_per_item + 1):
+            rows.append(
+                {
+                    "ID": child_id,
+                    "item": item_id,
+                    "name": f"Item {child_id}",
+                    "main": int(index == 0),
+                    "available": 1,
+                    "moveable": 1,
+                    "barcode": f"BC{item_id}",
+                }
+            )
+
+            for _ in range(images_per_row):
+                images.append({"ID": len(images) + 1, "itemChild": child_id})
+
+            child_id += 1
+
+    return rows, images
+
+
+def nested_scan_assembly(all_items, images):
+    main_items = [item for item in all_items if bool(item["main"])]
+    child_items = [item for item in all_items if not bool(item["main"])]
+
+    for row in main_items + child_items:
+        row["images"] = [image for image in images if image["itemChild"] == row["ID"]]
+        row["available"] = bool(row["available"])
+        row["moveable"] = bool(row["moveable"])
+        row["main"] = bool(row["main"])
+
+    for row in main_items:
+        row["children"] = [
+            child for child in child_items if child["item"] == row["item"]
+        ]
+
+    return main_items
+
+
+def time_assembly(assemble, rows, images):
+    rows = copy.deepcopy(rows)
+    start = time.perf_counter()
+    assemble(rows, images)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    print(f"{'rows':>8} {'images':>8} {'nested (s)':>12} {'indexed (s)':>12}")
+
+    for size in CATALOG_SIZES:
+        rows, images = create_catalog(*size)
+        nested = time_assembly(nested_scan_assembly, rows, images)
+        indexed = time_assembly(build_item_documents, rows, images)
+        print(f"{len(rows):>8} {len(images):>8} {nested:>12.4f} {indexed:>12.4f}")
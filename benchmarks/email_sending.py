@@ -0,0 +1,166 @@
+"""
+Compares sending emails the old way (flask_mail's Mail.send, which opens a new
+SMTP session for every message) with the pooled connections in util/email.py,
+both one message at a time with Emailer.send_email and as a batch with
+Emailer.send_messages. Reports messages per second and the number of SMTP
+sessions opened for each approach.
+
+The emails are sent to a minimal SMTP server started by this script on
+localhost. Connecting to a real mail server also means a TLS handshake and a
+login, so the stand-in waits "--handshake" milliseconds (default 50) before
+greeting each new session.
+
+Run from the root directory with: python benchmarks/email_sending.py
+"""
+import os
+import socketserver
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# util/config.py requires every setting to be present, but only the email
+# settings are used here so placeholders are enough for the rest
+for name in [
+    "JWT_SECRET_KEY",
+    "DB_HOST",
+    "DB_USERNAME",
+    "DB_PASSWORD",
+    "DB_DATABASE",
+    "EMAIL_SERVER",
+    "EMAIL_PORT",
+    "EMAIL_PASSWORD",
+]:
+    os.environ.setdefault(name, "unused")
+
+os.environ.setdefault("EMAIL_USERNAME", "inventory@localhost")
+os.environ.setdefault("EMAIL_USE_SSL", "false")
+os.environ.setdefault("EMAIL_USE_TLS", "false")
+
+from flask import Flask  # noqa: E402
+from util.email import Emailer  # noqa: E402
+
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    """
+    Speaks just enough SMTP for smtplib to send messages
+    """
+
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.server.add_session()
+        time.sleep(self.server.handshake)
+        self.reply("220 localhost SMTP stand-in")
+
+        for line in self.rfile:
+            command = line[:4].upper()
+
+            if command == b"DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+
+                for data in self.rfile:
+                    if data == b".\r\n":
+                        break
+
+                self.reply("250 OK")
+            elif command == b"QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handshake: float):
+        super().__init__(("127.0.0.1", 0), SMTPStandInHandler)
+        self.handshake = handshake
+        self.sessions = 0
+        self._lock = threading.Lock()
+
+    def add_session(self):
+        with self._lock:
+            self.sessions += 1
+
+
+def create_messages(count: int):
+    return [
+        Emailer.create_message(
+            f"user{index}@localhost",
+            "Due date notification",
+            f"Hello User {index},\n\nYour items will be due 2 days from today.",
+        )
+        for index in range(count)
+    ]
+
+
+def send_one_session_each(messages):
+    for message in messages:
+        Emailer._mail.send(message)
+
+
+def send_pooled(messages):
+    for message in messages:
+        Emailer.send_email(
+            message.recipients[0], message.subject, message.body, cc=None
+        )
+
+
+def send_batch(messages):
+    for _, error in Emailer.send_messages(messages):
+        if error is not None:
+            raise error
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--messages", type=int, default=200, help="Messages sent (default 200)"
+    )
+    parser.add_argument(
+        "--handshake",
+        type=float,
+        default=50,
+        help="Milliseconds to wait before greeting a new session (default 50)",
+    )
+    args = parser.parse_args()
+
+    server = SMTPStandIn(args.handshake / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    app = Flask(__name__)
+    app.config["MAIL_SERVER"] = "127.0.0.1"
+    app.config["MAIL_PORT"] = server.server_address[1]
+    Emailer.init(app)
+
+    print(f"Sending {args.messages} messages ({args.handshake:.0f} ms handshake)\n")
+    print(f"{'approach':>12} {'time (ms)':>10} {'messages/s':>11} {'sessions':>9}")
+
+    approaches = [
+        ("legacy", send_one_session_each),
+        ("pooled", send_pooled),
+        ("batch", send_batch),
+    ]
+
+    with app.app_context():
+        for name, send in approaches:
+            messages = create_messages(args.messages)
+            sessions = server.sessions
+
+            start = time.perf_counter()
+            send(messages)
+            elapsed = time.perf_counter() - start
+
+            print(
+                f"{name:>12} {elapsed * 1000:>10.0f} {len(messages) / elapsed:>11.0f}"
+                f" {server.sessions - sessions:>9}"
+            )
+
+    Emailer._pool.clear()
+    server.shutdown()
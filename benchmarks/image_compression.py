@@ -0,0 +1,132 @@
+"""
+Compares the old compress_image (a fixed 70% LANCZOS resize of the fully
+decoded image saved at quality 35) with the one in util/imaging.py. Reports the
+time, peak RSS and output size of each approach for every image in a corpus.
+
+Each compression runs in a fresh process so that its peak RSS isn't affected
+by the images compressed before it. The RSS of a process that has only imported
+Pillow is reported as the baseline.
+
+Run from the root directory with: python benchmarks/image_compression.py
+To use your own images instead of the generated corpus, pass a directory:
+python benchmarks/image_compression.py path/to/images
+"""
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from PIL import Image, ImageOps  # noqa: E402
+from util.imaging import compress_image  # noqa: E402
+
+# (name, width, height, format) of each generated image
+CORPUS = [
+    ("phone_12mp.jpg", 4032, 3024, "JPEG"),
+    ("camera_24mp.jpg", 6000, 4000, "JPEG"),
+    ("scan_8mp.png", 3264, 2448, "PNG"),
+    ("small.jpg", 1200, 900, "JPEG"),
+]
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def create_photo(width: int, height: int) -> Image.Image:
+    """
+    Creates an image that compresses roughly like a photo: smooth gradients
+    with some noise on top
+    """
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    red = Image.blend(gradient, noise, 0.3)
+    green = Image.blend(gradient.rotate(90), noise, 0.3)
+    blue = Image.blend(gradient.transpose(Image.FLIP_LEFT_RIGHT), noise, 0.3)
+
+    return Image.merge("RGB", (red, green, blue))
+
+
+def create_corpus(directory: str):
+    for name, width, height, image_format in CORPUS:
+        image = create_photo(width, height)
+        image.save(os.path.join(directory, name), format=image_format, quality=92)
+        image.close()
+
+
+def legacy_compress_image(image_path: str, output_path: str):
+    if os.path.getsize(image_path) <= 500_000:
+        shutil.copyfile(image_path, output_path)
+        return
+
+    image = Image.open(image_path)
+    width, height = image.size
+    image = image.resize((int(width * 0.70), int(height * 0.70)), Image.LANCZOS)
+    image = ImageOps.exif_transpose(image)
+    image.save(output_path, quality=35, optimize=True)
+    image.close()
+
+
+def peak_rss_mb() -> float:
+    """
+    Returns the peak RSS of this process. This is read from /proc (so it only
+    works on Linux) since, unlike getrusage, it isn't inherited from the parent.
+    """
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+
+    return float("nan")
+
+
+def measure(compress, image_path: str, output_path: str):
+    start = time.perf_counter()
+    compress(image_path, output_path)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, peak_rss_mb(), os.path.getsize(output_path)
+
+
+def run_in_new_process(func, *args):
+    context = multiprocessing.get_context("spawn")
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(func, *args).result()
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as output_directory:
+        if len(sys.argv) > 1:
+            corpus_directory = sys.argv[1]
+        else:
+            corpus_directory = os.path.join(output_directory, "corpus")
+            os.makedirs(corpus_directory)
+            print("Generating sample images...")
+            create_corpus(corpus_directory)
+
+        print(f"Baseline RSS: {run_in_new_process(peak_rss_mb):.1f} MB\n")
+        print(
+            f"{'image':>18} {'input (KB)':>11} {'engine':>7} {'time (ms)':>10}"
+            f" {'peak RSS (MB)':>14} {'output (KB)':>12}"
+        )
+
+        for name in sorted(os.listdir(corpus_directory)):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+
+            image_path = os.path.join(corpus_directory, name)
+            input_size = os.path.getsize(image_path) / 1000
+            engines = [("legacy", legacy_compress_image), ("new", compress_image)]
+
+            for engine, compress in engines:
+                output_path = os.path.join(output_directory, f"{engine}-{name}")
+                elapsed, rss, output_size = run_in_new_process(
+                    measure, compress, image_path, output_path
+                )
+
+                print(
+                    f"{name:>18} {input_size:>11.0f} {engine:>7}"
+                    f" {elapsed * 1000:>10.0f} {rss:>14.1f} {output_size / 1000:>12.0f}"
+                )
@@ -0,0 +1,204 @@
+"""
+Hammers the quantity of a single item with concurrent check outs and returns
+to make sure it can't be oversold. Many workers try to check out a unit of an
+item that only has a few in stock, then every worker that got one returns it.
+
+The old approach (decrement the quantity, commit, select it again and then
+mark the item as unavailable) is run first for comparison. It lets every
+worker check out a unit, so the quantity ends up negative. The approach in
+util/stock.py should only ever let "quantity" workers check out a unit and
+leave "available" matching the quantity.
+
+This needs a MySQL database with the repo's schema. The connection is read from
+the same .env file as the server, and a scratch item is created for each run
+then deleted. Workers are greenlets if gevent is installed (like the server's
+gunicorn workers), otherwise they're threads.
+
+Run from the root directory with: python benchmarks/quantity_stress.py
+"""
+try:
+    from gevent import monkey
+
+    monkey.patch_all()
+    from gevent.pool import Pool as WorkerPool
+except ImportError:
+    from multiprocessing.pool import ThreadPool as WorkerPool
+
+import os
+import sys
+import time
+import uuid
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import mysql.connector  # noqa: E402
+from util.config import secrets  # noqa: E402
+from util.stock import check_out_unit, return_unit  # noqa: E402
+
+
+def connect():
+    return mysql.connector.connect(
+        host=secrets["DB_HOST"],
+        user=secrets["DB_USERNAME"],
+        password=secrets["DB_PASSWORD"],
+        database=secrets["DB_DATABASE"],
+    )
+
+
+def create_item(quantity: int) -> int:
+    connection = connect()
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+        INSERT INTO item (barcode, available, moveable, location, quantity)
+        VALUES (%s, 1, 1, 'stress test', %s)
+        """,
+        (f"stress-{uuid.uuid4().hex[:12]}", quantity),
+    )
+    connection.commit()
+    item_id = cursor.lastrowid
+    cursor.close()
+    connection.close()
+
+    return item_id
+
+
+def delete_item(item_id: int):
+    connection = connect()
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM item WHERE ID = %s", (item_id,))
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+
+def get_item(item_id: int) -> dict:
+    connection = connect()
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT quantity, available FROM item WHERE ID = %s", (item_id,))
+    item = cursor.fetchall()[0]
+    cursor.close()
+    connection.close()
+
+    return item
+
+
+def legacy_check_out(cursor, connection, item_id: int) -> bool:
+    cursor.execute("UPDATE item SET quantity = quantity - 1 WHERE ID = %s", (item_id,))
+    connection.commit()
+    cursor.execute("SELECT quantity FROM item WHERE ID = %s", (item_id,))
+
+    if cursor.fetchall()[0]["quantity"] == 0:
+        cursor.execute("UPDATE item SET available = 0 WHERE ID = %s", (item_id,))
+
+    return True
+
+
+def legacy_return(cursor, connection, item_id: int):
+    cursor.execute(
+        "UPDATE item SET quantity = quantity + 1, available = 1 WHERE ID = %s",
+        (item_id,),
+    )
+
+
+def atomic_check_out(cursor, connection, item_id: int) -> bool:
+    return check_out_unit(cursor, item_id)
+
+
+def atomic_return(cursor, connection, item_id: int):
+    return_unit(cursor, item_id)
+
+
+# The check out and return functions of each approach
+ENGINES = {
+    "legacy": (legacy_check_out, legacy_return),
+    "atomic": (atomic_check_out, atomic_return),
+}
+
+
+def run_worker(engine: str, item_id: int) -> dict:
+    """
+    Checks out a unit of the item, waits a moment so other workers can run,
+    then returns it. Returns the quantity seen right after the check out.
+    """
+    check_out_func, return_func = ENGINES[engine]
+    connection = connect()
+    cursor = connection.cursor(dictionary=True)
+
+    try:
+        got_unit = check_out_func(cursor, connection, item_id)
+        connection.commit()
+
+        cursor.execute("SELECT quantity, available FROM item WHERE ID = %s", (item_id,))
+        seen = cursor.fetchall()[0]
+        connection.commit()
+
+        time.sleep(0.05)
+
+        if got_unit:
+            return_func(cursor, connection, item_id)
+            connection.commit()
+
+        return {"gotUnit": got_unit, **seen}
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def run(engine: str, quantity: int, workers: int):
+    item_id = create_item(quantity)
+
+    try:
+        start = time.perf_counter()
+
+        results = WorkerPool(workers).map(
+            lambda item: run_worker(engine, item), [item_id] * workers
+        )
+        elapsed = time.perf_counter() - start
+        final = get_item(item_id)
+    finally:
+        delete_item(item_id)
+
+    checked_out = sum(result["gotUnit"] for result in results)
+    lowest = min(result["quantity"] for result in results)
+    mismatched = sum(
+        bool(result["available"]) != (result["quantity"] > 0) for result in results
+    )
+    passed = (
+        checked_out <= quantity
+        and lowest >= 0
+        and final["quantity"] == quantity
+        and bool(final["available"])
+    )
+
+    print(
+        f"{engine:>7} {checked_out:>12} {lowest:>16} {mismatched:>18}"
+        f" {final['quantity']:>15} {elapsed * 1000:>10.0f} {'ok' if passed else 'FAIL':>7}"
+    )
+
+    return passed
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--quantity", type=int, default=3, help="Units in stock (default 3)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=100, help="Concurrent check outs (default 100)"
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{args.workers} workers checking out an item with {args.quantity} in stock\n"
+    )
+    print(
+        f"{'engine':>7} {'checked out':>12} {'lowest quantity':>16}"
+        f" {'available wrong':>18} {'final quantity':>15} {'time (ms)':>10} {'result':>7}"
+    )
+
+    run("legacy", args.quantity, args.workers)
+    passed = run("atomic", args.quantity, args.workers)
+
+    sys.exit(0 if passed else 1)
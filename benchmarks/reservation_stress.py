@@ -0,0 +1,158 @@
+"""
+Sends concurrent POST /api/reservations/ requests for the same item and time
+to make sure the route can't overbook it. A scratch item with a few units and
+one scratch user per request are created, then every user tries to reserve
+the item at once. Only "quantity" of the requests should succeed and the rest
+should be rejected with a 409.
+
+This runs the app in-process with Flask's test client, so it needs the same
+.env file and MySQL database as the server. Everything it creates is deleted
+at the end. Every background job is disabled so none of them run. Workers are
+greenlets if gevent is installed (like the server's gunicorn workers),
+otherwise they're threads. Keep --workers below the connection pool size (5)
+so requests don't fail because the pool is empty.
+
+Run from the root directory with: python benchmarks/reservation_stress.py
+"""
+try:
+    from gevent import monkey
+
+    monkey.patch_all()
+    from gevent.pool import Pool as WorkerPool
+except ImportError:
+    from multiprocessing.pool import ThreadPool as WorkerPool
+
+import os
+import sys
+import uuid
+from argparse import ArgumentParser
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ["SCHEDULER_ENABLED"] = "false"
+os.environ["IMAGE_PROCESSING_ENABLED"] = "false"
+os.environ["EMAIL_OUTBOX_ENABLED"] = "false"
+
+import mysql.connector  # noqa: E402
+from app import app  # noqa: E402
+from flask_jwt_extended import create_access_token  # noqa: E402
+from util.config import secrets  # noqa: E402
+
+
+def connect():
+    return mysql.connector.connect(
+        host=secrets["DB_HOST"],
+        user=secrets["DB_USERNAME"],
+        password=secrets["DB_PASSWORD"],
+        database=secrets["DB_DATABASE"],
+    )
+
+
+def create_fixtures(quantity: int, users: int):
+    """
+    Creates an item with "quantity" units and "users" users,
+    returning the item's ID and the users' emails
+    """
+    run_id = uuid.uuid4().hex[:12]
+    connection = connect()
+    cursor = connection.cursor()
+
+    cursor.execute(
+        """
+        INSERT INTO item (barcode, available, moveable, location, quantity)
+        VALUES (%s, 1, 1, 'stress test', %s)
+        """,
+        (f"stress-{run_id}", quantity),
+    )
+    item_id = cursor.lastrowid
+    cursor.execute(
+        """
+        INSERT INTO itemChild (item, name, type, main)
+        VALUES (%s, 'Stress test item', 'stress test', 1)
+        """,
+        (item_id,),
+    )
+
+    emails = [f"stress-{run_id}-{index}@localhost" for index in range(users)]
+    cursor.executemany(
+        """
+        INSERT INTO users (fullName, email, verified, role, password)
+        VALUES ('Stress Test', %s, 1, 'User', '')
+        """,
+        [(email,) for email in emails],
+    )
+
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+    return item_id, emails
+
+
+def delete_fixtures(item_id: int, emails):
+    connection = connect()
+    cursor = connection.cursor()
+
+    cursor.execute("DELETE FROM reservation WHERE item = %s", (item_id,))
+    cursor.execute("DELETE FROM itemChild WHERE item = %s", (item_id,))
+    cursor.execute("DELETE FROM item WHERE ID = %s", (item_id,))
+    cursor.executemany(
+        "DELETE FROM users WHERE email = %s", [(email,) for email in emails]
+    )
+
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+
+def reserve(item_id: int, email: str) -> int:
+    with app.app_context():
+        token = create_access_token(
+            identity={"ID": 0, "role": "Admin", "verified": True}
+        )
+
+    response = app.test_client().post(
+        "/api/reservations/",
+        json={
+            "email": email,
+            "item": item_id,
+            "startDateTime": "2030-01-01T10:00:00.000Z",
+            "endDateTime": "2030-01-02T10:00:00.000Z",
+            "status": "Pending",
+        },
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+    return response.status_code
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--quantity", type=int, default=2, help="Units of the item (default 2)"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=40, help="Reservations requested (default 40)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Concurrent requests (default 4)"
+    )
+    args = parser.parse_args()
+
+    item_id, emails = create_fixtures(args.quantity, args.requests)
+
+    try:
+        statuses = WorkerPool(args.workers).map(
+            lambda email: reserve(item_id, email), emails
+        )
+    finally:
+        delete_fixtures(item_id, emails)
+
+    counts = Counter(statuses)
+    passed = counts[200] == args.quantity and counts[409] == len(emails) - args.quantity
+
+    print(f"{args.requests} requests for an item with {args.quantity} units")
+    print(f"Responses: {dict(sorted(counts.items()))}")
+    print("ok" if passed else "FAIL: the item was overbooked or requests failed")
+
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,102 @@
+"""
+Compares searching a synthetic catalog with the inverted index in util/search.py
+against a scan that matches names the same way "name LIKE '%query%'" does.
+Also reports how many queries each approach needs to hydrate its results.
+
+Run from the root directory with: python benchmarks/search.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from util.search import SearchIndex  # noqa: E402
+
+CATALOG_SIZES = [1_000, 5_000, 20_000]
+CHILDREN_PER_ITEM = 3
+QUERIES = ["camera", "tripod", "sony a7", "cable", "lens 50mm", "zz-no-match"]
+SEARCHES_PER_QUERY = 20
+COMMON_WORDS = ["camera", "tripod", "lens", "cable", "battery", "kit", "sony", "50mm"]
+
+
+def create_vocabulary(size: int):
+    """
+    Real catalogs mostly contain words that only appear in a few items, so
+    most of the vocabulary is made up of random words
+    """
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = [
+        "".join(random.choices(letters, k=random.randint(4, 9))) for _ in range(size)
+    ]
+    return COMMON_WORDS + words
+
+
+def create_rows(main_count: int):
+    random.seed(main_count)
+    words = create_vocabulary(main_count)
+    rows = []
+
+    for item_id in range(1, main_count + 1):
+        for index in range(CHILDREN_PER_ITEM + 1):
+            rows.append(
+                {
+                    "item": item_id,
+                    "main": index == 0,
+                    "name": " ".join(random.sample(words, 3)),
+                    "description": " ".join(random.sample(words, 6)),
+                    "type": random.choice(words),
+                    "serial": f"SN-{item_id:06d}-{index}",
+                    "vendorName": random.choice(words),
+                }
+            )
+
+    return rows
+
+
+def like_scan(rows, query: str):
+    query = query.lower()
+    return [row["item"] for row in rows if row["main"] and query in row["name"].lower()]
+
+
+def time_per_search(search, query: str):
+    start = time.perf_counter()
+
+    for _ in range(SEARCHES_PER_QUERY):
+        results = search(query)
+
+    return (time.perf_counter() - start) / SEARCHES_PER_QUERY, results
+
+
+if __name__ == "__main__":
+    print(
+        f"{'items':>7} {'query':>12} {'scan (ms)':>10} {'index (ms)':>11}"
+        f" {'matches':>8} {'scan queries':>13} {'index queries':>14}"
+    )
+
+    for size in CATALOG_SIZES:
+        rows = create_rows(size)
+        start = time.perf_counter()
+        index = SearchIndex(rows)
+        build_time = time.perf_counter() - start
+
+        for query in QUERIES:
+            scan_time, scan_results = time_per_search(
+                lambda q: like_scan(rows, q), query
+            )
+            index_time, index_results = time_per_search(index.search, query)
+
+            # The old route ran one query for the search, then for every match
+            # one query for its images, one for its children and one for the
+            # images of each child. The new route always runs three.
+            scan_queries = 1 + len(scan_results) * (2 + CHILDREN_PER_ITEM)
+            index_queries = 3 if index_results else 1
+
+            print(
+                f"{size:>7} {query:>12} {scan_time * 1000:>10.3f}"
+                f" {index_time * 1000:>11.3f} {len(index_results):>8}"
+                f" {scan_queries:>13} {index_queries:>14}"
+            )
+
+        print(f"{size:>7} {'(build)':>12} {'':>10} {build_time * 1000:>11.3f}")
@@ -0,0 +1,8 @@
+-- Uploaded images are compressed in the background (see
+-- src/background_tasks/images.py), so each image keeps track of whether
+-- it's been processed yet. Existing images were compressed when they were
+-- uploaded so they default to 'ready'.
+ALTER TABLE itemImage
+    ADD COLUMN status ENUM('processing', 'ready', 'failed') NOT NULL DEFAULT 'ready',
+    ADD COLUMN uploaded DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ADD INDEX itemImage_status (status);
@@ -0,0 +1,8 @@
+-- Smaller copies of every image are created when it's processed (see
+-- IMAGE_VARIANTS in src/util/imaging.py). The full size image is still
+-- stored in imagePath and imageURL.
+ALTER TABLE itemImage
+    ADD COLUMN thumbnailPath VARCHAR(255) NULL DEFAULT NULL,
+    ADD COLUMN thumbnailURL VARCHAR(255) NULL DEFAULT NULL,
+    ADD COLUMN cardPath VARCHAR(255) NULL DEFAULT NULL,
+    ADD COLUMN cardURL VARCHAR(255) NULL DEFAULT NULL;
@@ -0,0 +1,7 @@
+-- Uploaded images are stored under the SHA-256 hash of their contents so
+-- identical uploads share the same files (see upload_image in
+-- src/routes/inventory.py). Images uploaded before this have no hash and
+-- keep their original files.
+ALTER TABLE itemImage
+    ADD COLUMN contentHash CHAR(64) NULL DEFAULT NULL,
+    ADD INDEX itemImage_contentHash (contentHash);
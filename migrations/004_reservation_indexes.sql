@@ -0,0 +1,8 @@
+-- Supports filtering reservations by status, user or item within a window
+-- of start dates, sorted and paginated by start date (see find_reservations
+-- in src/routes/reservation.py). InnoDB appends the primary key to each
+-- index, which covers the (startDateTime, ID) keyset pagination as well.
+ALTER TABLE reservation
+    ADD INDEX reservation_status_startDateTime (status, startDateTime),
+    ADD INDEX reservation_user_startDateTime (user, startDateTime),
+    ADD INDEX reservation_item_startDateTime (item, startDateTime);
@@ -0,0 +1,5 @@
+-- Lets create_reservation find the reservations that overlap a requested
+-- time with a range on endDateTime, which skips every reservation that ended
+-- before the requested start (see has_capacity in src/routes/reservation.py).
+ALTER TABLE reservation
+    ADD INDEX reservation_item_endDateTime (item, endDateTime);
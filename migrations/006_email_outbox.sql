@@ -0,0 +1,20 @@
+-- Emails are queued in the same transaction as the change they're about and
+-- sent in the background (see src/background_tasks/outbox.py), so requests
+-- don't wait on the mail server and queued emails survive restarts. Emails
+-- are deleted once they're sent.
+CREATE TABLE emailOutbox (
+    ID INT NOT NULL AUTO_INCREMENT,
+    recipient VARCHAR(255) NOT NULL,
+    cc VARCHAR(255) NULL DEFAULT NULL,
+    subject VARCHAR(255) NOT NULL,
+    body TEXT NOT NULL,
+    attachmentName VARCHAR(255) NULL DEFAULT NULL,
+    attachment MEDIUMBLOB NULL DEFAULT NULL,
+    status ENUM('pending', 'failed') NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    nextAttempt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    lastError TEXT NULL DEFAULT NULL,
+    created DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (ID),
+    INDEX emailOutbox_status_nextAttempt (status, nextAttempt)
+);
@@ -0,0 +1,6 @@
+-- Users can subscribe to a calendar feed of their reservations (see
+-- get_calendar_feed in src/routes/reservation.py) using a token that can be
+-- replaced or revoked. Only the SHA-256 hash of the token is stored.
+ALTER TABLE users
+    ADD COLUMN calendarToken CHAR(64) NULL DEFAULT NULL,
+    ADD UNIQUE INDEX users_calendarToken (calendarToken);
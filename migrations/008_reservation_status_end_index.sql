@@ -0,0 +1,5 @@
+-- Lets the nightly due date notifications (see due_date_iterator in
+-- src/background_tasks/notification.py) read only the checked out
+-- reservations that are due soon instead of every reservation.
+ALTER TABLE reservation
+    ADD INDEX reservation_status_endDateTime (status, endDateTime);
@@ -2,6 +2,7 @@ from argparse import ArgumentParser
 from routes.users import users_blueprint
 from routes.reservation import reservation_blueprint
 from routes.inventory import inventory_blueprint
+from routes.images import images_blueprint
 import logging
 from flask import Flask, jsonify, request, Response
 from flask_cors import CORS
@@ -50,6 +51,7 @@ app.logger.setLevel(gunicorn_logger.level)
 app.register_blueprint(users_blueprint, url_prefix="/api/users")
 app.register_blueprint(reservation_blueprint, url_prefix="/api/reservations")
 app.register_blueprint(inventory_blueprint, url_prefix="/api/inventory")
+app.register_blueprint(images_blueprint, url_prefix="/images")
 
 
 @app.after_request
@@ -0,0 +1,200 @@
+"""
+Compresses uploaded images outside of the request that uploaded them. Uploads
+are stored as-is with the status 'processing' and this task, which runs on the
+scheduler (see util/scheduler.py), hands them to a pool of separate processes
+that compress them and create their variants (see util/imaging.py). Each image
+is marked as 'ready' (or 'failed') once it's done.
+"""
+import multiprocessing
+import os.path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from flask import Flask
+from util.config import secrets
+from util.database import Database
+from util.imaging import get_content_addressed_path, process_image
+from util.versioning import ItemChanges, ResourceVersions
+
+# The most images that are picked up each time the task runs
+BATCH_SIZE = 50
+
+# Like the counters in util/versioning.py, these are created before gunicorn
+# forks its workers so they can be read from any worker even though the
+# scheduler only runs in the main process
+_stats = {
+    "processed": multiprocessing.Value("Q", 0),
+    "failed": multiprocessing.Value("Q", 0),
+    "inFlight": multiprocessing.Value("Q", 0),
+    # Total seconds between an upload and its processing finishing
+    "totalLatency": multiprocessing.Value("d", 0),
+    # Total seconds spent compressing images
+    "totalProcessingTime": multiprocessing.Value("d", 0),
+    "lastLatency": multiprocessing.Value("d", 0),
+}
+
+_executor = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+
+    # The pool is only created the first time there's an image to process
+    # so that servers with the scheduler disabled don't start extra processes
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=secrets["IMAGE_PROCESSING_WORKERS"])
+
+    return _executor
+
+
+def get_image_queue_stats(queued: int) -> dict:
+    """
+    Returns the processing statistics of every image processed since the server
+    started. "queued" is the number of images still waiting to be processed.
+    """
+    processed = _stats["processed"].value + _stats["failed"].value
+    averages = {"averageLatency": None, "averageProcessingTime": None}
+
+    if processed:
+        averages["averageLatency"] = _stats["totalLatency"].value / processed
+        averages["averageProcessingTime"] = (
+            _stats["totalProcessingTime"].value / processed
+        )
+
+    return {
+        "queued": queued,
+        "inFlight": _stats["inFlight"].value,
+        "processed": _stats["processed"].value,
+        "failed": _stats["failed"].value,
+        "lastLatency": _stats["lastLatency"].value,
+        **averages,
+    }
+
+
+def create_image_url(image_path: str) -> str:
+    return f"{secrets['BASE_URL']}/images/{os.path.basename(image_path)}"
+
+
+def add_stat(name: str, value=1):
+    with _stats[name].get_lock():
+        _stats[name].value += value
+
+
+def get_output_path(image: dict) -> str:
+    """
+    Returns where the processed version of an image should be saved. Images
+    uploaded before content addressing (without a hash) are processed in place.
+    """
+    if image["contentHash"] is None:
+        return image["imagePath"]
+
+    folder = os.path.dirname(image["imagePath"])
+    extension = image["imagePath"].rsplit(".", 1)[-1]
+
+    return get_content_addressed_path(folder, image["contentHash"], extension)
+
+
+@Database.with_connection()
+def process_pending_images(app: Flask, **kwargs):
+    cursor = kwargs["cursor"]
+    connection = kwargs["connection"]
+
+    cursor.execute(
+        """
+        SELECT A.ID, A.imagePath, A.contentHash, A.uploaded, B.item
+        FROM itemImage AS A
+        LEFT JOIN itemChild AS B on A.itemChild = B.ID
+        WHERE A.status = 'processing'
+        ORDER BY A.ID
+        LIMIT %s
+        """,
+        (BATCH_SIZE,),
+    )
+
+    # Rows with the same hash share the same files (see upload_image in
+    # routes/inventory.py) so each image only needs to be processed once
+    images = {}
+
+    for row in cursor.fetchall():
+        key = row["contentHash"] or row["ID"]
+        images.setdefault(key, []).append(row)
+
+    if not images:
+        return
+
+    executor = get_executor()
+    futures = {
+        executor.submit(
+            process_image, rows[0]["imagePath"], get_output_path(rows[0])
+        ): rows
+        for rows in images.values()
+    }
+    add_stat("inFlight", len(futures))
+
+    for future in as_completed(futures):
+        rows = futures[future]
+        image = rows[0]
+
+        values = {
+            "ID": image["ID"],
+            "contentHash": image["contentHash"],
+            "status": "failed",
+            "imagePath": image["imagePath"],
+            "imageURL": create_image_url(image["imagePath"]),
+            "thumbnailPath": None,
+            "thumbnailURL": None,
+            "cardPath": None,
+            "cardURL": None,
+        }
+
+        try:
+            result = future.result()
+            add_stat("totalProcessingTime", result["processingTime"])
+            add_stat("processed")
+            values["status"] = "ready"
+            values["imagePath"] = result["imagePath"]
+            values["imageURL"] = create_image_url(result["imagePath"])
+
+            for variant, path in result["variants"].items():
+                values[f"{variant}Path"] = path
+                values[f"{variant}URL"] = create_image_url(path)
+        except Exception as err:
+            app.logger.exception(str(err))
+            add_stat("failed")
+
+        latency = (datetime.now() - image["uploaded"]).total_seconds()
+        add_stat("totalLatency", latency)
+        add_stat("inFlight", -1)
+        _stats["lastLatency"].value = latency
+
+        cursor.execute(
+            """
+            UPDATE itemImage
+            SET
+                status = %(status)s,
+                imagePath = %(imagePath)s,
+                imageURL = %(imageURL)s,
+                thumbnailPath = %(thumbnailPath)s,
+                thumbnailURL = %(thumbnailURL)s,
+                cardPath = %(cardPath)s,
+                cardURL = %(cardURL)s
+            WHERE contentHash = %(contentHash)s OR ID = %(ID)s
+            """,
+            values,
+        )
+        connection.commit()
+        ResourceVersions.bump("inventory")
+        ItemChanges.record(*{row["item"] for row in rows})
+
+        # Every row with this hash now points to the same file, so the other
+        # originals aren't needed. The same image uploaded at the same time has
+        # a separate original for each upload (see upload_image).
+        for path in {row["imagePath"] for row in rows} - {values["imagePath"]}:
+            try:
+                os.remove(path)
+            except FileNotFoundError as err:
+                app.logger.exception(str(err))
+
+
+def image_iterator(app: Flask):
+    with app.app_context():
+        process_pending_images(app)
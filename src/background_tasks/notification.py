@@ -1,8 +1,7 @@
 from flask import Flask
 from util.email import Emailer
-from smtplib import SMTPException
 from util.database import Database
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 def create_alert_email_body(name: str, days: int, items):
@@ -20,81 +19,82 @@ def create_alert_email_body(name: str, days: int, items):
     )
 
 
-@Database.with_connection()
-def retrieve_user_credentials(user_id: int, item_id: int, **kwargs):
-    """
-    This function is used to search through the database for the credentials of the users
-    and items that is checked out. Later then returned as a list
-    """
-    creds = []
-    cursor = kwargs["cursor"]
-
-    cursor.execute("SELECT * FROM users WHERE ID = %s", (user_id,))
-
-    user = cursor.fetchone()
-    email = user["email"]
-    name = user["fullName"]
-
-    cursor.execute("SELECT name FROM itemChild WHERE item = %s", (item_id,))
-
-    item = cursor.fetchall()
+# Users are notified when their items are due in this many days
+NOTIFICATION_DAYS = (1, 2, 7)
 
-    item_name = []
-    for row in item:
-        item_name.append(row["name"])
+DUE_RESERVATIONS_QUERY = """
+    SELECT
+        R.ID, R.endDateTime, U.email, U.fullName, C.name AS itemName
+    FROM reservation AS R
+    JOIN item AS I ON R.item = I.ID
+    JOIN users AS U ON R.user = U.ID
+    LEFT JOIN itemChild AS C ON C.item = R.item
+    WHERE R.status = 'Checked Out' AND I.moveable = 1 AND ({windows})
+    ORDER BY R.ID, C.main DESC, C.ID
+"""
 
-    creds = {"email": email, "name": name, "item_name": item_name}
 
-    return creds
+def get_due_windows(now: datetime):
+    """
+    Returns the (start, end) range of due dates for each entry in
+    NOTIFICATION_DAYS. A reservation is due in N days if there are at
+    least N (but less than N + 1) whole days until it ends.
+    """
+    return [
+        (now + timedelta(days=days), now + timedelta(days=days + 1))
+        for days in NOTIFICATION_DAYS
+    ]
 
 
 @Database.with_connection()
 def due_date_iterator(app: Flask, **kwargs):
+    """
+    Emails every user with a checked out item that's due in 1, 2 or 7 days.
+    The reservations that are due, along with their users and item names, are
+    selected in one query that reads a range of the (status, endDateTime) index
+    for each day, so this only reads the reservations that are due.
+    """
     cursor = kwargs["cursor"]
-
-    cursor.execute("SELECT ID, user, endDateTime, status, item from reservation")
-    dates = cursor.fetchall()
-
     todays_date = datetime.now()
+    windows = get_due_windows(todays_date)
 
-    # loops through the due dates for all the reservations in the table
-    # calculate the amount of days from the due date by using todays date
-    for row in dates:
-        days_to_duedate = row["endDateTime"] - todays_date
-
-        # select item and the status of the of the reservation
-        item_ID = row["item"]
-        reservation_status = row["status"]
-        # Select from items table the user the due date belongs to
-        # check whether the items are moveable are not
-        cursor.execute("SELECT * FROM item WHERE ID = %s", (item_ID,))
-        item = cursor.fetchone()
-
-        if not item:
-            return
-
-        item_moveable = bool(item["moveable"])
-
-        user_id = row["user"]
-
-        # If item is moveable then we check if the item is due in 1 day and send out an email
-        if (
-            item_moveable
-            and reservation_status == "Checked Out"
-            and days_to_duedate.days in {1, 2, 7}
-        ):
-            text = retrieve_user_credentials(user_id, item_ID)
-            user_email = text["email"]
-            user_name = text["name"]
-            item_names = text["item_name"]
-
-            body = create_alert_email_body(
-                user_name,
-                days_to_duedate.days,
-                item_names,
+    cursor.execute(
+        DUE_RESERVATIONS_QUERY.format(
+            windows=" OR ".join(
+                ["(R.endDateTime >= %s AND R.endDateTime < %s)"] * len(windows)
             )
-            with app.app_context():
-                try:
-                    Emailer.send_email(user_email, "Due date notification", body)
-                except SMTPException as err:
-                    app.logger.exception(str(err))
+        ),
+        [date for window in windows for date in window],
+    )
+
+    # There's a row for every name of a reservation's item (one for the main
+    # item and one for each of its children)
+    reservations = {}
+
+    for row in cursor.fetchall():
+        reservation = reservations.setdefault(row["ID"], {**row, "itemNames": []})
+
+        if row["itemName"] is not None:
+            reservation["itemNames"].append(row["itemName"])
+
+    messages = []
+
+    for reservation in reservations.values():
+        days_to_duedate = reservation["endDateTime"] - todays_date
+        body = create_alert_email_body(
+            reservation["fullName"],
+            days_to_duedate.days,
+            reservation["itemNames"],
+        )
+        messages.append(
+            Emailer.create_message(reservation["email"], "Due date notification", body)
+        )
+
+    # The emails are sent together so they can share a connection
+    with app.app_context():
+        try:
+            for message, error in Emailer.send_messages(messages):
+                if error is not None:
+                    app.logger.error(f"{message.recipients[0]}: {error}")
+        except OSError as err:
+            app.logger.exception(str(err))
@@ -0,0 +1,103 @@
+"""
+Sends the emails queued with Emailer.queue_email (see util/email.py). This task
+runs on the scheduler (see util/scheduler.py) and sends every email that's due,
+deleting it once it's been sent. Emails that couldn't be sent are retried with
+an exponential backoff until they've failed MAX_ATTEMPTS times, after which
+they're marked as 'failed' and kept so they can be looked into.
+"""
+from flask import Flask
+from util.database import Database
+from util.email import Emailer
+
+# The most emails that are sent each time the task runs
+BATCH_SIZE = 50
+
+MAX_ATTEMPTS = 8
+
+# Seconds to wait before the first retry. This doubles with every
+# failed attempt, up to MAX_RETRY_DELAY.
+RETRY_DELAY = 30
+MAX_RETRY_DELAY = 60 * 60
+
+
+def get_retry_delay(attempts: int) -> int:
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def schedule_retry(cursor, email: dict, error: Exception):
+    attempts = email["attempts"] + 1
+
+    cursor.execute(
+        """
+        UPDATE emailOutbox
+        SET
+            attempts = %s,
+            status = %s,
+            lastError = %s,
+            nextAttempt = NOW() + INTERVAL %s SECOND
+        WHERE ID = %s
+        """,
+        (
+            attempts,
+            "failed" if attempts >= MAX_ATTEMPTS else "pending",
+            str(error),
+            get_retry_delay(attempts),
+            email["ID"],
+        ),
+    )
+
+
+@Database.with_connection()
+def send_queued_emails(app: Flask, **kwargs):
+    cursor = kwargs["cursor"]
+    connection = kwargs["connection"]
+
+    cursor.execute(
+        """
+        SELECT * FROM emailOutbox
+        WHERE status = 'pending' AND nextAttempt <= NOW()
+        ORDER BY nextAttempt, ID
+        LIMIT %s
+        """,
+        (BATCH_SIZE,),
+    )
+
+    emails = cursor.fetchall()
+    messages = [
+        Emailer.create_message(
+            email["recipient"],
+            email["subject"],
+            email["body"],
+            email["attachment"],
+            cc=email["cc"],
+            attachment_name=email["attachmentName"],
+        )
+        for email in emails
+    ]
+    sent = 0
+
+    # Every email in the batch is sent over the same connection
+    try:
+        for _, error in Emailer.send_messages(messages):
+            email = emails[sent]
+            sent += 1
+
+            if error is None:
+                cursor.execute("DELETE FROM emailOutbox WHERE ID = %s", (email["ID"],))
+            else:
+                app.logger.error(str(error))
+                schedule_retry(cursor, email, error)
+
+            connection.commit()
+    except OSError as err:
+        # SMTPException is a subclass of OSError, so this covers not being able
+        # to connect to the mail server. The rest of the batch waits for the
+        # next run instead of failing too.
+        app.logger.exception(str(err))
+        schedule_retry(cursor, emails[sent], err)
+        connection.commit()
+
+
+def outbox_iterator(app: Flask):
+    with app.app_context():
+        send_queued_emails(app)
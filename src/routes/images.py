@@ -0,0 +1,62 @@
+import mimetypes
+import os
+import re
+from flask import Blueprint, current_app, send_from_directory
+from util.config import secrets
+from util.response import create_error_response
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+images_blueprint = Blueprint("images", __name__)
+
+# Content addressed images are named after the SHA-256 hash of their contents,
+# optionally followed by the name of a variant (see util/imaging.py), so the
+# file behind one of these names can never change
+CONTENT_ADDRESSED_NAME = re.compile(r"^[0-9a-f]{64}(_[a-z]+)?\.[a-z]+$")
+
+# One year, the longest max-age that's generally respected
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+@images_blueprint.route("/<path:filename>", methods=["GET"])
+def get_image(filename):
+    """
+    Serves an image from the image folder. The response has a strong ETag and
+    supports Range requests, and images with content addressed names can be
+    cached forever. Other images have to be revalidated with their ETag.
+
+    The file is passed to the server's wsgi.file_wrapper so gunicorn can send
+    it with sendfile instead of reading it into memory. If IMAGE_ACCEL_REDIRECT
+    is set, the file is instead handed off to nginx with an X-Accel-Redirect
+    header so that no worker time is spent sending it.
+    """
+    immutable = CONTENT_ADDRESSED_NAME.match(filename) is not None
+    image_folder = os.path.abspath(current_app.config["IMAGE_FOLDER"])
+
+    if secrets["IMAGE_ACCEL_REDIRECT"]:
+        # safe_join returns None for paths that would leave the image folder
+        if safe_join(image_folder, filename) is None:
+            return create_error_response("Image not found", 404)
+
+        location = secrets["IMAGE_ACCEL_REDIRECT"].rstrip("/")
+        # nginx keeps the Content-Type of this response when it serves the file
+        mimetype, _ = mimetypes.guess_type(filename)
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers["X-Accel-Redirect"] = f"{location}/{filename}"
+    else:
+        try:
+            response = send_from_directory(
+                image_folder, filename, conditional=True, etag=True
+            )
+        except NotFound:
+            return create_error_response("Image not found", 404)
+
+    if immutable:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+
+    return response
@@ -1,148 +1,333 @@
+import csv
 import mysql.connector
 import os
-from io import BytesIO
-from flask import Blueprint, jsonify, current_app, request
+import uuid
+from io import BytesIO, StringIO
+from tempfile import NamedTemporaryFile
+from typing import List, Optional
+from flask import (
+    Blueprint,
+    Response,
+    jsonify,
+    current_app,
+    json,
+    request,
+    stream_with_context,
+)
 from flask_jwt_extended import jwt_required
 from util.database import Database
 from util.response import create_error_response, convert_javascript_date
-from util.request import require_roles
+from util.request import (
+    limit_request_body,
+    parse_limit_parameter,
+    require_roles,
+    save_request_body,
+    with_etag,
+)
 from util.config import secrets
-from util.imaging import compress_image
-from werkzeug.utils import secure_filename
+from util.versioning import ItemChanges, ResourceVersions
+from util.cache import BarcodeIndex, CatalogCache
+from util.search import ItemSearch
+from background_tasks.images import get_image_queue_stats
+from util.imaging import hash_file
+from util.catalog import (
+    IMAGE_COLUMN_ALIASES,
+    IMAGE_SIZES,
+    ITEM_SELECT_QUERY,
+    build_item_documents,
+    chunked,
+    create_placeholders,
+    decode_page_cursor,
+    encode_page_cursor,
+    iter_item_documents,
+    load_item_documents,
+    normalize_item,
+    select_image_size,
+)
 from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
 import base64
 
 inventory_blueprint = Blueprint("inventory", __name__)
 VALID_IMAGE_EXTENSIONS = {"jpg", "png", "jpeg"}
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_IMPORT_SIZE = 10_000
+IMPORT_CHUNK_SIZE = 500
+MAX_BATCH_SIZE = 1_000
+REQUIRED_CHILD_FIELDS = ("name", "type")
+REQUIRED_ITEM_FIELDS = ("barcode", "available", "moveable", "location", "name", "type")
+CSV_BOOLEANS = {"true": 1, "yes": 1, "false": 0, "no": 0}
+IMAGE_SIZE_ERROR = f"Parameter imageSize must be one of {', '.join(IMAGE_SIZES)}"
+
+
+def get_image_size():
+    """
+    Returns the size of the images the client asked for with the "imageSize"
+    query parameter ("full" by default) or None if it isn't a valid size
+    """
+    image_size = request.args.get("imageSize", default="full", type=str)
+    return image_size if image_size in IMAGE_SIZES else None
+
+
+def query_by_id(item_id):
+    """
+    Returns the document of the itemChild with the given ID (including its
+    children and images) or None if there's no item with that ID.
+    """
+    return CatalogCache.get_or_load(("id", item_id), lambda: load_by_id(item_id))
 
 
 @Database.with_connection()
-def query_by_id(item_id, **kwargs):
+def load_by_id(item_id, **kwargs):
+    """
+    Loads an item document in at most three queries: one for the item, one for
+    its children and one for the images of the item and all of its children.
+    """
     cursor = kwargs["cursor"]
 
-    cursor.execute("SELECT * from itemImage WHERE itemChild = %s", (item_id,))
+    cursor.execute(ITEM_SELECT_QUERY + "WHERE A.ID = %s", (item_id,))
+    rows = cursor.fetchall()
+
+    if not rows:
+        return None
+
+    result = rows[0]
+
+    if result["main"]:
+        return load_item_documents(cursor, [result])[0]
+
+    cursor.execute("SELECT * FROM itemImage WHERE itemChild = %s", (item_id,))
+
+    result["images"] = cursor.fetchall()
+    result["children"] = []
+
+    return normalize_item(result)
+
+
+@inventory_blueprint.route("/", methods=["GET"])
+@jwt_required()
+@with_etag("inventory")
+def get_all():
+    """
+    Returns every main item along with its children and images. If either
+    "limit" or "cursor" is passed as a query parameter, this returns a single
+    page of main items instead (see get_page). If "stream" is true, the catalog
+    is streamed back as it's read from the database (see stream_all).
+
+    Every route that returns items accepts "imageSize" (thumbnail, card or full)
+    to choose which size of each image the imageURL points at.
+    """
+    image_size = get_image_size()
+
+    if image_size is None:
+        return create_error_response(IMAGE_SIZE_ERROR, 400)
+
+    if request.args.get("stream", default="false", type=str).lower() == "true":
+        return stream_all(image_size)
+
+    if "limit" in request.args or "cursor" in request.args:
+        return get_page(image_size)
+
+    # The catalog is cached already serialized so that repeat requests
+    # can skip both the database and encoding the JSON
+    catalog = CatalogCache.get_or_load(
+        ("catalog", image_size), lambda: query_all_items(image_size)
+    )
+
+    if catalog is None:
+        return create_error_response("An unexpected error occurred", 500)
+
+    return current_app.response_class(catalog, mimetype="application/json")
+
+
+@Database.with_connection()
+def query_all_items(image_size: str, **kwargs):
+    """
+    Returns every main item along with its children and images as a JSON string.
+    """
+    cursor = kwargs["cursor"]
+
+    cursor.execute("SELECT * FROM itemImage")
     images = cursor.fetchall()
 
-    query = """
+    # Since MySQL doesn't have full join, we'll have to do a left join
+    # unioned with a right join. Because that returns everything from
+    # both tables, we need to make sure columns with the same name
+    # aren't included twice.
+    cursor.execute(
+        """
         SELECT
-            A.*, B.barcode, B.available, B.moveable, B.location, B.quantity
-        FROM itemChild AS A
-        LEFT JOIN item AS B on A.item = B.ID
-        WHERE A.ID = %(item_id)s
+            A.barcode, A.available, A.moveable, A.location, A.quantity,
+            A.retiredDateTime, B.*
+        FROM item AS A
+        LEFT JOIN itemChild AS B on B.item = A.ID
         UNION
         SELECT
-            A.*, B.barcode, B.available, B.moveable, B.location, B.quantity
+            A.barcode, A.available, A.moveable, A.location, A.quantity,
+            A.retiredDateTime, B.*
+        FROM item AS A
+        RIGHT JOIN itemChild B on B.item = A.ID
+        """
+    )
+    all_items = cursor.fetchall()
+
+    items = build_item_documents(all_items, images)
+
+    return json.dumps(select_image_size(items, image_size))
+
+
+def stream_all(image_size: str):
+    """
+    Streams the same JSON array as get_all one main item at a time. Rows are
+    read incrementally from an unbuffered cursor, so memory usage stays bounded
+    by the size of the largest item instead of the size of the catalog.
+    """
+    image_columns = ", ".join(
+        f"C.{column} AS {alias}" for column, alias in IMAGE_COLUMN_ALIASES.items()
+    )
+    query = f"""
+        SELECT
+            A.*, B.barcode, B.available, B.moveable, B.location, B.quantity,
+            B.retiredDateTime, {image_columns}
         FROM itemChild AS A
         LEFT JOIN item AS B on A.item = B.ID
-        WHERE A.ID = %(item_id)s
+        LEFT JOIN itemImage AS C on C.itemChild = A.ID
+        ORDER BY A.item, A.ID, C.ID
     """
 
-    cursor.execute(query, {"item_id": item_id})
-    result = cursor.fetchone()
-
-    if not result:
-        return None
+    try:
+        rows = Database.stream_rows(query)
+    except mysql.connector.Error as err:
+        current_app.logger.exception(str(err))
+        return create_error_response("An unexpected error occurred", 500)
 
-    result["moveable"] = bool(result["moveable"])
-    result["available"] = bool(result["available"])
-    result["main"] = bool(result["main"])
-    result["images"] = images
-    result["children"] = []
+    if rows is None:
+        return create_error_response(
+            "Too many catalog streams are open, try again later", 503
+        )
 
-    if result["main"]:
-        query = """
-            SELECT
-                A.*, B.barcode, B.available, B.moveable, B.location, B.quantity
-            FROM itemChild AS A
-            LEFT JOIN item AS B on A.item = B.ID
-            WHERE A.item = %(item)s AND A.main = 0
-            UNION
-            SELECT
-                A.*, B.barcode, B.available, B.moveable, B.location, B.quantity
-            FROM itemChild AS A
-            LEFT JOIN item AS B on A.item = B.ID
-            WHERE A.item = %(item)s AND A.main = 0
-        """
+    def generate():
+        try:
+            yield "["
 
-        cursor.reset()
-        cursor.execute(query, {"item": result["item"]})
-        children = cursor.fetchall()
+            for index, item in enumerate(iter_item_documents(rows)):
+                item = select_image_size([item], image_size)[0]
+                yield ("," if index else "") + json.dumps(item)
 
-        for child in children:
-            cursor.execute(
-                "SELECT * FROM itemImage WHERE itemChild = %s" % (child["ID"],)
-            )
+            yield "]"
+        except mysql.connector.Error as err:
+            # The status code has already been sent at this point so the best we
+            # can do is log the error and end the response early. The array is
+            # left unclosed so clients can't mistake this for the full catalog.
+            current_app.logger.exception(str(err))
 
-            child["images"] = cursor.fetchall()
-            child["moveable"] = bool(child["moveable"])
-            child["available"] = bool(child["available"])
-            child["main"] = bool(child["main"])
+    response = Response(stream_with_context(generate()), mimetype="application/json")
+    # This closes the connection even if the response is never iterated over
+    response.call_on_close(rows.close)
 
-        result["children"] = children
+    return response
 
-    return result
 
-
-@inventory_blueprint.route("/", methods=["GET"])
-@jwt_required()
 @Database.with_connection()
-def get_all(**kwargs):
+def get_page(image_size: str, **kwargs):
+    """
+    Returns a page of at most "limit" main items ordered by ID along with a
+    cursor that can be passed back to get the next page. Since the page starts
+    from the last ID of the previous page (instead of using an offset), each
+    page costs the same no matter how deep into the catalog it is.
+    """
     cursor = kwargs["cursor"]
 
     try:
-        cursor.execute("SELECT * FROM itemImage")
-        images = cursor.fetchall()
+        limit = parse_limit_parameter(DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    except ValueError as err:
+        return create_error_response(str(err), 400)
 
-        # Since MySQL doesn't have full join, we'll have to do a left join
-        # unioned with a right join. Because that returns everything from
-        # both tables, we need to make sure columns with the same name
-        # aren't included twice.
+    try:
+        last_id = decode_page_cursor(request.args.get("cursor"))
+    except ValueError:
+        return create_error_response("Invalid cursor", 400)
+
+    try:
+        # Fetch one extra row so we know whether there's another page
         cursor.execute(
-            """
-            SELECT
-                A.barcode, A.available, A.moveable, A.location, A.quantity,
-                A.retiredDateTime, B.*
-            FROM item AS A
-            LEFT JOIN itemChild AS B on B.item = A.ID
-            UNION
-            SELECT
-                A.barcode, A.available, A.moveable, A.location, A.quantity,
-                A.retiredDateTime, B.*
-            FROM item AS A
-            RIGHT JOIN itemChild B on B.item = A.ID
-            """
+            ITEM_SELECT_QUERY + "WHERE A.main = 1 AND A.ID > %s ORDER BY A.ID LIMIT %s",
+            (last_id, limit + 1),
         )
-        all_items = cursor.fetchall()
-        main_items = [item for item in all_items if bool(item["main"])]
-        child_items = [item for item in all_items if not bool(item["main"])]
-        response = []
-
-        # Add all images to each item
-        for row in main_items + child_items:
-            row["images"] = [
-                image for image in images if image["itemChild"] == row["ID"]
-            ]
+        main_rows = cursor.fetchall()
+        has_next_page = len(main_rows) > limit
+        main_rows = main_rows[:limit]
 
-            # These booleans are stored as bits in the database so we
-            # need to convert them to boleans before sending the response
-            row["available"] = bool(row["available"])
-            row["moveable"] = bool(row["moveable"])
-            row["main"] = bool(row["main"])
-
-        # Add the child to the main items if the main item has children
-        for row in main_items:
-            row["children"] = [
-                child for child in child_items if child["item"] == row["item"]
-            ]
-            response.append(row)
-
-        return jsonify(response)
+        items = select_image_size(load_item_documents(cursor, main_rows), image_size)
+        next_cursor = encode_page_cursor(main_rows[-1]["ID"]) if has_next_page else None
 
+        return jsonify({"items": items, "nextCursor": next_cursor})
     except mysql.connector.Error as err:
         current_app.logger.exception(str(err))
         return create_error_response("An unexpected error occurred", 500)
 
 
+@inventory_blueprint.route("/cacheStats", methods=["GET"])
+@require_roles(["admin", "super"])
+def get_cache_stats():
+    """
+    Returns the hit and miss counts of the catalog cache. Note that each
+    worker has its own cache, so this only reflects the worker that handled
+    the request.
+    """
+    return jsonify(CatalogCache.stats())
+
+
+def remove_image_files(image: dict):
+    """
+    Deletes the file of an itemImage row along with the files of its variants
+    """
+    paths = [image["imagePath"], image["thumbnailPath"], image["cardPath"]]
+
+    for path in filter(None, paths):
+        try:
+            os.remove(path)
+        except (IsADirectoryError, FileNotFoundError) as err:
+            current_app.logger.exception(str(err))
+
+
+def find_unreferenced_images(cursor, images: List[dict]) -> List[dict]:
+    """
+    Takes itemImage rows that were just deleted and returns one row for each
+    file that no other itemImage row references anymore. Images are shared by
+    every row with the same content hash. Images uploaded before content
+    addressing (without a hash) only ever have one row.
+
+    This has to run in the same transaction as the delete, and the files should
+    be removed before committing. The remaining rows are selected FOR UPDATE,
+    which keeps uploads of the same image waiting until the files are gone.
+    """
+    hashes = list({image["contentHash"] for image in images if image["contentHash"]})
+    referenced = set()
+
+    if hashes:
+        cursor.execute(
+            f"""
+            SELECT contentHash FROM itemImage
+            WHERE contentHash IN ({create_placeholders(hashes)})
+            FOR UPDATE
+            """,
+            hashes,
+        )
+        referenced = {row["contentHash"] for row in cursor.fetchall()}
+
+    unreferenced = {}
+
+    for image in images:
+        if image["contentHash"] is None:
+            unreferenced[image["ID"]] = image
+        elif image["contentHash"] not in referenced:
+            unreferenced[image["contentHash"]] = image
+
+    return list(unreferenced.values())
+
+
 @inventory_blueprint.route("/<int:item_id>", methods=["DELETE"])
 @require_roles(["admin", "super"])
 @Database.with_connection()
@@ -150,27 +335,15 @@ def delete_item(item_id, **kwargs):
     cursor = kwargs["cursor"]
     connection = kwargs["connection"]
 
-    # Before we delete the item, we first need to delete the image files from the
-    # server (including child images if the item we're deleting is a parent item).
-    # If this step fails for some reason, we can still try to delete the item
-    # from the database
+    # Before we delete the item, we first need to delete its reservations if it's
+    # a parent item. If this step fails for some reason, we can still try to
+    # delete the item from the database
     try:
         cursor.execute("SELECT item, main FROM itemChild WHERE ID = %s" % (item_id,))
 
         item = cursor.fetchone()
 
         if item["main"]:
-            cursor.execute(
-                "SELECT imagePath from itemImage WHERE itemChild = %s", (item_id,)
-            )
-            image_paths = [row["imagePath"] for row in cursor.fetchall()]
-
-            for image_path in image_paths:
-                try:
-                    os.remove(image_path)
-                except (IsADirectoryError, FileNotFoundError) as err:
-                    current_app.logger.exception(str(err))
-
             cursor.execute("DELETE FROM reservation WHERE item = %s", (item["item"],))
 
     except Exception as err:
@@ -181,6 +354,19 @@ def delete_item(item_id, **kwargs):
 
         item = cursor.fetchone()
 
+        # The images of every itemChild row that's deleted (including child items
+        # if this is a parent item) are deleted along with it
+        if item["main"]:
+            image_filter = "itemChild IN (SELECT ID FROM itemChild WHERE item = %s)"
+            image_params = (item["item"],)
+        else:
+            image_filter = "itemChild = %s"
+            image_params = (item_id,)
+
+        cursor.execute(f"SELECT * FROM itemImage WHERE {image_filter}", image_params)
+        images = cursor.fetchall()
+        cursor.execute(f"DELETE FROM itemImage WHERE {image_filter}", image_params)
+
         # If this is the main item, we also need to delete its associated children
         if item["main"]:
             cursor.execute(
@@ -189,7 +375,12 @@ def delete_item(item_id, **kwargs):
 
         cursor.execute("DELETE FROM itemChild WHERE ID = %s" % (item_id,))
 
+        for image in find_unreferenced_images(cursor, images):
+            remove_image_files(image)
+
         connection.commit()
+        ResourceVersions.bump("inventory", "reservations")
+        ItemChanges.record(item["item"])
     except mysql.connector.Error as err:
         current_app.logger.exception(str(err))
         connection.rollback()
@@ -201,13 +392,18 @@ def delete_item(item_id, **kwargs):
 @inventory_blueprint.route("/<int:item_id>", methods=["GET"])
 @jwt_required()
 def get_item_by_id(item_id):
+    image_size = get_image_size()
+
+    if image_size is None:
+        return create_error_response(IMAGE_SIZE_ERROR, 400)
+
     try:
         item = query_by_id(item_id)
 
         if not item:
             return create_error_response("Item not found", 404)
 
-        return jsonify(item)
+        return jsonify(select_image_size([item], image_size)[0])
     except mysql.connector.Error as err:
         current_app.log_exception(str(err))
         return create_error_response("An unexpected error occurred", 500)
@@ -215,225 +411,433 @@ def get_item_by_id(item_id):
 
 @inventory_blueprint.route("/search", methods=["GET"])
 @jwt_required()
-@Database.with_connection()
-def get_item_by_name(**kwargs):
-    cursor = kwargs["cursor"]
-    query = """
-        SELECT
-            A.*, B.barcode, B.available, B.moveable, B.location, B.quantity
-        FROM itemChild AS A
-        LEFT JOIN item AS B on A.item = B.ID
-        WHERE name LIKE %(item_name)s AND A.main = 1
-        UNION
-        SELECT
-            A.*, B.barcode, B.available, B.moveable, B.location, B.quantity
-        FROM itemChild AS A
-        RIGHT JOIN item AS B on A.item = B.ID
-        WHERE name LIKE %(item_name)s AND A.main = 1
+def get_item_by_name():
+    """
+    Searches the name, description, type, serial and vendor of every item and
+    its children. Each word in "query" has to match the start of a word in one
+    of those columns. Main items are returned with the best matches first and
+    "limit" can optionally be passed to limit the number of results.
     """
-    item_name = request.args.get("query", default="", type=str)
+    query = request.args.get("query", default="", type=str)
+    image_size = get_image_size()
+
+    if image_size is None:
+        return create_error_response(IMAGE_SIZE_ERROR, 400)
 
     try:
-        cursor.execute(query, {"item_name": f"%{item_name}%"})
-        items = cursor.fetchall()
-        response = []
+        limit = parse_limit_parameter(None, MAX_PAGE_SIZE)
+    except ValueError as err:
+        return create_error_response(str(err), 400)
 
-        for row in items:
-            row["available"] = bool(row["available"])
-            row["moveable"] = bool(row["moveable"])
-            row["main"] = bool(row["main"])
+    items = CatalogCache.get_or_load(
+        ("search", query, limit), lambda: query_by_search(query, limit)
+    )
 
-            cursor.execute(
-                "SELECT * FROM itemImage WHERE itemChild = %s" % (row["ID"],)
-            )
-            row["images"] = cursor.fetchall()
-
-            query = """
-                SELECT
-                    A.*, B.barcode, B.available, B.moveable, B.location, B.quantity
-                FROM itemChild AS A
-                LEFT JOIN item AS B on A.item = B.ID
-                WHERE item = %(item)s AND A.main = 0
-                UNION
-                SELECT
-                    A.*, B.barcode, B.available, B.moveable, B.location, B.quantity
-                FROM itemChild AS A
-                RIGHT JOIN item AS B on A.item = B.ID
-                WHERE item = %(item)s AND A.main = 0
-            """
-            cursor.execute(query, {"item": row["item"]})
+    if items is None:
+        return create_error_response("An unexpected error occurred", 500)
 
-            row["children"] = cursor.fetchall()
+    return jsonify(select_image_size(items, image_size))
 
-            for child in row["children"]:
-                child["moveable"] = bool(child["moveable"])
-                child["main"] = bool(child["main"])
-                child["available"] = bool(child["available"])
 
-                cursor.execute(
-                    "SELECT * FROM itemImage WHERE itemChild = %s" % (child["ID"],)
-                )
-                child["images"] = cursor.fetchall()
+def query_by_search(query: str, limit=None):
+    item_ids = ItemSearch.search(query, load_search_rows, limit)
 
-            response.append(row)
+    if item_ids is None:
+        return None
 
-        return jsonify(response)
-    except mysql.connector.Error as err:
-        current_app.log_exception(str(err))
-        return create_error_response("An unexpected error occurred", 500)
+    return query_main_items(item_ids)
 
 
-@inventory_blueprint.route("/barcode/<barcode>", methods=["GET"])
-@jwt_required()
 @Database.with_connection()
-def get_item_by_barcode(barcode, **kwargs):
+def load_search_rows(item_ids: Optional[List[int]], **kwargs):
+    """
+    Returns the columns of the itemChild rows that are used to build the search
+    index, either for the items in "item_ids" or for every item if it's None
+    """
     cursor = kwargs["cursor"]
-    query = """
-        SELECT
-            A.*, B.barcode, B.available, B.moveable, B.location, B.quantity
-        FROM itemChild AS A
-        LEFT JOIN item AS B on A.item = B.ID
-        WHERE B.barcode = %(barcode)s
-        UNION
-        SELECT
-            A.*, B.barcode, B.available, B.moveable, B.location, B.quantity
-        FROM itemChild AS A
-        RIGHT JOIN item AS B on A.item = B.ID
-        WHERE B.barcode = %(barcode)s
+    query = (
+        "SELECT item, main, name, description, type, serial, vendorName FROM itemChild"
+    )
+
+    if item_ids is None:
+        cursor.execute(query)
+        return cursor.fetchall()
+
+    rows = []
+
+    for _, chunk in chunked(item_ids, MAX_BATCH_SIZE):
+        cursor.execute(f"{query} WHERE item IN ({create_placeholders(chunk)})", chunk)
+        rows.extend(cursor.fetchall())
+
+    return rows
+
+
+@Database.with_connection()
+def query_main_items(item_ids, **kwargs):
     """
+    Returns the documents of the main items that belong to the given IDs in the
+    item table, in the same order as "item_ids". This only takes three queries
+    no matter how many items there are.
+    """
+    cursor = kwargs["cursor"]
 
-    try:
-        cursor.execute(query, {"barcode": barcode})
-        all_items = cursor.fetchall()
+    if not item_ids:
+        return []
 
-        if len(all_items) == 0:
-            return create_error_response(f"No item found with barcode {barcode}", 404)
+    cursor.execute(
+        ITEM_SELECT_QUERY
+        + f"WHERE A.main = 1 AND A.item IN ({create_placeholders(item_ids)})",
+        item_ids,
+    )
 
-        # Find the first parent item that has this barcode and add children to
-        # the main item if it has children. This assumes all barcodes are unique
-        main_item = next(item for item in all_items if bool(item["main"]))
-        child_items = [item for item in all_items if not bool(item["main"])]
+    positions = {item_id: index for index, item_id in enumerate(item_ids)}
+    main_rows = sorted(cursor.fetchall(), key=lambda row: positions[row["item"]])
 
-        for row in child_items + [main_item]:
-            cursor.execute(
-                "SELECT * FROM itemImage WHERE itemChild = %s" % (row["ID"],)
-            )
-            row["images"] = cursor.fetchall()
-            row["children"] = []
-            row["available"] = bool(row["available"])
-            row["moveable"] = bool(row["moveable"])
-            row["main"] = bool(row["main"])
+    return load_item_documents(cursor, main_rows)
 
-        main_item["children"] = [
-            child for child in child_items if child["item"] == row["item"]
-        ]
 
-        return jsonify(main_item)
-    except mysql.connector.Error as err:
-        current_app.log_exception(str(err))
+@inventory_blueprint.route("/barcode/<barcode>", methods=["GET"])
+@jwt_required()
+def get_item_by_barcode(barcode):
+    image_size = get_image_size()
+
+    if image_size is None:
+        return create_error_response(IMAGE_SIZE_ERROR, 400)
+
+    item = BarcodeIndex.get_or_load(barcode, lambda: query_by_barcode(barcode))
+
+    if item is None:
         return create_error_response("An unexpected error occurred", 500)
 
+    if not item:
+        return create_error_response(f"No item found with barcode {barcode}", 404)
+
+    return jsonify(select_image_size([item], image_size)[0])
+
+
+@Database.with_connection()
+def query_by_barcode(barcode: str, **kwargs):
+    """
+    Returns the document of the main item with this barcode or an empty dict
+    if there isn't one, since None is returned if the query fails (see
+    Database.with_connection). This assumes all barcodes are unique.
+    """
+    cursor = kwargs["cursor"]
+
+    cursor.execute(
+        ITEM_SELECT_QUERY + "WHERE B.barcode = %s AND A.main = 1 LIMIT 1", (barcode,)
+    )
+    items = load_item_documents(cursor, cursor.fetchall())
+
+    return items[0] if items else {}
+
 
 @inventory_blueprint.route("/<int:item_id>/uploadImage", methods=["POST"])
 @require_roles(["admin", "super"])
 @Database.with_connection()
 def upload_image(item_id, **kwargs):
     """
-    This route can receive either a JavaScript FormData object with the key
-    'image' or a JSON object with the name of the image and the image data
-    encoded as a base64 string
+    This route can receive a JavaScript FormData object with the key 'image',
+    a JSON object with the name of the image and the image data encoded as a
+    base64 string, or the raw image with the content type
+    'application/octet-stream' and the name of the image passed as the query
+    parameter "filename". Raw images are streamed to disk as they're received,
+    so they're the best option for large images.
+
+    The image is stored as-is with the status 'processing' and is compressed
+    later by the image task in background_tasks/images.py. Uploading an image
+    that's already stored (for another item for example) reuses that image.
     """
     cursor = kwargs["cursor"]
     connection = kwargs["connection"]
-    post_data = request.get_json() or {}
-
-    try:
-        # Check to see if we received a FormData object
+    image_folder = current_app.config["IMAGE_FOLDER"]
+    max_size = secrets["MAX_IMAGE_UPLOAD_SIZE"]
+    too_large_message = f"Images can't be larger than {max_size} bytes"
+    image = None
+
+    # Reject images that are too large before reading any of the body
+    if request.content_length is not None and request.content_length > max_size:
+        return create_error_response(too_large_message, 413)
+
+    if request.mimetype != "application/octet-stream":
+        # The Content-Length header might not be sent at all, so the size of
+        # the body is also checked while it's parsed (save_request_body does
+        # the same for raw images). Both results are cached by the request.
+        limit_request_body(max_size)
+
+        try:
+            request.files
+            request.get_json(silent=True)
+        except RequestEntityTooLarge:
+            return create_error_response(too_large_message, 413)
+
+    if request.mimetype == "application/octet-stream":
+        filename = request.args.get("filename", default="", type=str)
+    elif "image" in request.files:
+        # Werkzeug spools large files in multipart bodies to disk
+        # so these don't have to be held in memory either
         image = request.files["image"]
-    except KeyError:
-        # No form data was passed so check the request body instead
-        pass
-
-    try:
-        # We didn't get a FormData object so encode the base64 image as a
-        # byte stream and save it
-        filename = post_data["filename"]
-        content_type = "image/png" if filename.endswith("png") else "image/jpeg"
-        file_data = BytesIO(base64.b64decode(post_data["image"]))
-
-        image = FileStorage(
-            stream=file_data,
-            filename=filename,
-            content_type=content_type,
-        )
-    except KeyError:
-        return create_error_response("An image is required", 400)
-    except Exception:
-        return create_error_response("An unexpected error occurred", 500)
+        filename = image.filename
+    else:
+        post_data = request.get_json(silent=True) or {}
+
+        try:
+            # We didn't get a FormData object so encode the base64 image as a
+            # byte stream and save it
+            filename = post_data["filename"]
+            content_type = "image/png" if filename.endswith("png") else "image/jpeg"
+            file_data = BytesIO(base64.b64decode(post_data["image"]))
+
+            image = FileStorage(
+                stream=file_data,
+                filename=filename,
+                content_type=content_type,
+            )
+        except KeyError:
+            return create_error_response("An image is required", 400)
+        except Exception:
+            return create_error_response("An unexpected error occurred", 500)
 
     # Make sure we only received images with valid extensions
-    if image.filename.split(".")[-1] not in VALID_IMAGE_EXTENSIONS:
+    if filename.split(".")[-1] not in VALID_IMAGE_EXTENSIONS:
         extensions = ", ".join(VALID_IMAGE_EXTENSIONS)
         return create_error_response(f"Extension must be one of {extensions}", 400)
 
+    temp_path = None
+    stored_path = None
+
     try:
-        os.makedirs(current_app.config["IMAGE_FOLDER"], exist_ok=True)
+        cursor.execute("SELECT item FROM itemChild WHERE ID = %s", (item_id,))
+        item = cursor.fetchall()
 
-        filename = secure_filename(image.filename)
+        if not item:
+            return create_error_response("Item not found", 404)
 
-        image_path = os.path.join(current_app.config["IMAGE_FOLDER"], filename)
-        image_url = f"{secrets['BASE_URL']}/images/{filename}"
+        os.makedirs(image_folder, exist_ok=True)
+
+        if image is None:
+            try:
+                temp_path = save_request_body(image_folder, max_size)
+            except RequestEntityTooLarge:
+                return create_error_response(too_large_message, 413)
+        else:
+            with NamedTemporaryFile(
+                dir=image_folder, prefix="upload-", delete=False
+            ) as file:
+                temp_path = file.name
+                image.save(file)
+
+        content_hash = hash_file(temp_path)
+
+        # Images are stored under the hash of their contents, so uploading an
+        # image that's already stored reuses its files. This also locks the rows
+        # sharing the image so it can't be deleted while this is running.
+        cursor.execute(
+            "SELECT * FROM itemImage WHERE contentHash = %s LIMIT 1 FOR UPDATE",
+            (content_hash,),
+        )
+        existing = cursor.fetchall()
+
+        if existing:
+            values = existing[0]
+        else:
+            # The original is kept under a separate name until it's processed
+            # since the content addressed name is for the processed image. The
+            # name is unique to this upload so that if the same image is being
+            # uploaded at the same time, neither upload can replace or remove
+            # the file the other one's row points to.
+            extension = filename.rsplit(".", 1)[-1].lower()
+            stored_name = f"{content_hash}.{uuid.uuid4().hex}.original.{extension}"
+            stored_path = os.path.join(image_folder, stored_name)
+            values = {
+                "imagePath": stored_path,
+                "imageURL": f"{secrets['BASE_URL']}/images/{stored_name}",
+                "thumbnailPath": None,
+                "thumbnailURL": None,
+                "cardPath": None,
+                "cardURL": None,
+                "status": "processing",
+            }
 
-        query = """
-            INSERT INTO itemImage (itemChild, imagePath, imageURL)
-            VALUES (%s, %s, %s)
-        """
-        cursor.execute(query, (item_id, image_path, image_url))
+            os.replace(temp_path, stored_path)
+            temp_path = None
 
-        image.save(image_path)
-        compress_image(image_path)
+        cursor.execute(
+            """
+            INSERT INTO itemImage (
+                itemChild, contentHash, imagePath, imageURL, thumbnailPath,
+                thumbnailURL, cardPath, cardURL, status
+            )
+            VALUES (
+                %(itemChild)s, %(contentHash)s, %(imagePath)s, %(imageURL)s,
+                %(thumbnailPath)s, %(thumbnailURL)s, %(cardPath)s, %(cardURL)s,
+                %(status)s
+            )
+            """,
+            {**values, "itemChild": item_id, "contentHash": content_hash},
+        )
 
         connection.commit()
+        stored_path = None
+        ResourceVersions.bump("inventory")
+        ItemChanges.record(item[0]["item"])
 
-        return jsonify({"imageID": cursor.lastrowid})
+        return jsonify({"imageID": cursor.lastrowid, "status": values["status"]})
     except Exception as err:
         current_app.logger.exception(str(err))
         connection.rollback()
         return create_error_response(
             "An unexpected error occurred uploading image", 500
         )
+    finally:
+        # Only files created by this request that didn't end up being
+        # referenced by a row are left here
+        for path in filter(None, [temp_path, stored_path]):
+            os.remove(path)
+
+
+@inventory_blueprint.route("/imageQueue", methods=["GET"])
+@require_roles(["admin", "super"])
+@Database.with_connection()
+def get_image_queue(**kwargs):
+    """
+    Returns how many uploaded images are still waiting to be processed along
+    with how long processing has been taking
+    """
+    cursor = kwargs["cursor"]
+
+    cursor.execute(
+        "SELECT COUNT(*) AS queued FROM itemImage WHERE status = 'processing'"
+    )
+    queued = cursor.fetchall()[0]["queued"]
+
+    return jsonify(get_image_queue_stats(queued))
 
 
 @inventory_blueprint.route("/image/<int:image_id>", methods=["DELETE"])
 @require_roles(["admin", "super"])
 @Database.with_connection()
 def delete_image(image_id, **kwargs):
+    """
+    Deletes an itemImage row. The image's files are only removed if no other
+    row references them.
+    """
     cursor = kwargs["cursor"]
     connection = kwargs["connection"]
 
     try:
-        cursor.execute("SELECT imagePath FROM itemImage WHERE ID = %s" % (image_id,))
+        cursor.execute(
+            """
+            SELECT A.*, B.item
+            FROM itemImage AS A
+            LEFT JOIN itemChild AS B on A.itemChild = B.ID
+            WHERE A.ID = %s
+            """,
+            (image_id,),
+        )
 
-        file = cursor.fetchone()
+        file = cursor.fetchall()
 
         if not file:
             return create_error_response("Image not found", 404)
 
         cursor.execute("DELETE FROM itemImage WHERE ID = %s" % (image_id,))
+
+        for image in find_unreferenced_images(cursor, file):
+            remove_image_files(image)
+
         connection.commit()
+        ResourceVersions.bump("inventory")
+        ItemChanges.record(file[0]["item"])
     except mysql.connector.errors.Error as err:
         connection.rollback()
         current_app.logger.exception(str(err))
         return create_error_response("An unexpected error occurred", 500)
 
-    try:
-        os.remove(file["imagePath"])
-    except (IsADirectoryError, FileNotFoundError) as err:
-        current_app.logger.exception(str(err))
-
     return jsonify({"status": "Success"})
 
 
+INSERT_ITEM_QUERY = """
+    INSERT INTO item (barcode, available, moveable, location)
+    VALUES (%(barcode)s, %(available)s, %(moveable)s, %(location)s)
+"""
+
+INSERT_ITEM_CHILD_QUERY = """
+    INSERT INTO itemChild (
+        item,
+        name,
+        description,
+        type,
+        serial,
+        vendorName,
+        vendorPrice,
+        purchaseDate,
+        main
+    )
+    VALUES (
+        %(item_id)s,
+        %(name)s,
+        %(description)s,
+        %(type)s,
+        %(serial)s,
+        %(vendor_name)s,
+        %(vendor_price)s,
+        %(purchase_date)s,
+        %(main)s
+    )
+"""
+
+
+def parse_item_values(data: dict):
+    """
+    Takes the body of a request to create a main item and returns the values
+    to insert into the item table and the itemChild table (without the ID of
+    the item). Raises a KeyError if a required parameter is missing.
+    """
+    # These values are required so we need to check for any key errors.
+    # This will be inserted into the item table
+    item_values = {
+        "barcode": data["barcode"],
+        "available": int(data["available"]),
+        "moveable": int(data["moveable"]),
+        "location": data["location"],
+    }
+
+    return item_values, parse_item_child_values(data, main=True)
+
+
+def parse_item_child_values(data: dict, main: bool):
+    """
+    Takes the body of a request to create an item and returns the values to
+    insert into the itemChild table (without the ID of the item). Raises a
+    KeyError if a required parameter is missing.
+    """
+    values = {
+        "name": data["name"],
+        "type": data["type"],
+        "main": main,
+        # Using 'get' for these parameters so that they can default
+        # to None (NULL in mysql's case) when inserted without a value
+        "description": data.get("description"),
+        "vendor_name": data.get("vendorName"),
+        "purchase_date": data.get("purchaseDate"),
+        "vendor_price": data.get("vendorPrice"),
+        "serial": data.get("serial"),
+    }
+
+    # Only convert these values if they exists. Otherwise, we'll want them
+    # to be null in the database
+    if values["vendor_price"]:
+        values["vendor_price"] = float(values["vendor_price"])
+
+    if values["purchase_date"]:
+        # This date will come as a timestamp from the frontend so it needs to be
+        # converted to play nicely with MySQL's date format
+        values["purchase_date"] = convert_javascript_date(values["purchase_date"])
+
+    return values
+
+
 @inventory_blueprint.route("/add", methods=["POST"])
 @require_roles(["admin", "super"])
 @Database.with_connection()
@@ -442,90 +846,24 @@ def add_item(**kwargs):
     connection = kwargs["connection"]
 
     post_data = request.get_json()
-    item_values = {}
-
-    try:
-        # These values are required so we need to check for any key errors.
-        # This will be inserted into the item table
-        item_values["barcode"] = post_data["barcode"]
-        item_values["available"] = int(post_data["available"])
-        item_values["moveable"] = int(post_data["moveable"])
-        item_values["location"] = post_data["location"]
-    except KeyError as err:
-        current_app.log_exception(str(err))
-        return create_error_response(f"Parameter {err.args[0]} is required", 400)
-
-    item_child_values = {}
 
     try:
-        # These values will be inserted into the item child table
-        item_child_values["name"] = post_data["name"]
-        item_child_values["type"] = post_data["type"]
-        item_child_values["main"] = True
-
-        # Using 'get' for these parameters so that they can default
-        # to None (NULL in mysql's case) when inserted without a value
-        item_child_values["description"] = post_data.get("description")
-        item_child_values["vendor_name"] = post_data.get("vendorName")
-        item_child_values["purchase_date"] = post_data.get("purchaseDate")
-        item_child_values["vendor_price"] = post_data.get("vendorPrice")
-        item_child_values["serial"] = post_data.get("serial")
-
-        # Only convert these values if they exists. Otherwise, we'll want them
-        # to be null in the database
-        if item_child_values["vendor_price"]:
-            item_child_values["vendor_price"] = float(item_child_values["vendor_price"])
-
-        if item_child_values["purchase_date"]:
-            # This date will come as a timestamp from the frontend so it needs to be
-            # converted to play nicely with MySQL's date format
-            item_child_values["purchase_date"] = convert_javascript_date(
-                item_child_values["purchase_date"]
-            )
-
+        item_values, item_child_values = parse_item_values(post_data)
     except KeyError as err:
         current_app.log_exception(str(err))
         return create_error_response(f"Parameter {err.args[0]} is required", 400)
 
     try:
-        query = """
-            INSERT INTO item (barcode, available, moveable, location)
-            VALUES (%(barcode)s, %(available)s, %(moveable)s, %(location)s)
-        """
-
-        cursor.execute(query, item_values)
+        cursor.execute(INSERT_ITEM_QUERY, item_values)
 
         # Get the ID of the item we just inserted since it's used as a foreign key
         # for the 'item' row in the 'itemChild' table
         item_child_values["item_id"] = cursor.lastrowid
 
-        query = """
-            INSERT INTO itemChild (
-                item,
-                name,
-                description,
-                type,
-                serial,
-                vendorName,
-                vendorPrice,
-                purchaseDate,
-                main
-            )
-            VALUES (
-                %(item_id)s,
-                %(name)s,
-                %(description)s,
-                %(type)s,
-                %(serial)s,
-                %(vendor_name)s,
-                %(vendor_price)s,
-                %(purchase_date)s,
-                %(main)s
-            )
-        """
-
-        cursor.execute(query, item_child_values)
+        cursor.execute(INSERT_ITEM_CHILD_QUERY, item_child_values)
         connection.commit()
+        ResourceVersions.bump("inventory")
+        ItemChanges.record(item_child_values["item_id"])
 
         inserted_item = query_by_id(cursor.lastrowid)
 
@@ -546,53 +884,19 @@ def add_child_item(item_id, **kwargs):
     cursor = kwargs["cursor"]
     connection = kwargs["connection"]
     post_data = request.get_json()
-    values = {}
 
     try:
-        values["name"] = post_data["name"]
-        values["type"] = post_data["type"]
+        values = parse_item_child_values(post_data, main=False)
     except KeyError as err:
         return create_error_response(f"Parameter {err.args[0]} is required", 400)
 
-    values["main"] = False
     values["item_id"] = item_id
-    values["description"] = post_data.get("description")
-    values["serial"] = post_data.get("serial")
-    values["vendor_name"] = post_data.get("vendorName")
-    values["vendor_price"] = post_data.get("vendorPrice")
-    values["purchase_date"] = post_data.get("purchaseDate")
-
-    if values["purchase_date"]:
-        values["purchase_date"] = convert_javascript_date(values["purchase_date"])
 
     try:
-        query = """
-            INSERT INTO itemChild (
-                item,
-                name,
-                description,
-                type,
-                serial,
-                vendorName,
-                vendorPrice,
-                purchaseDate,
-                main
-            )
-            VALUES (
-                %(item_id)s,
-                %(name)s,
-                %(description)s,
-                %(type)s,
-                %(serial)s,
-                %(vendor_name)s,
-                %(vendor_price)s,
-                %(purchase_date)s,
-                %(main)s
-            )
-        """
-
-        cursor.execute(query, values)
+        cursor.execute(INSERT_ITEM_CHILD_QUERY, values)
         connection.commit()
+        ResourceVersions.bump("inventory")
+        ItemChanges.record(item_id)
 
         inserted_item = query_by_id(cursor.lastrowid)
 
@@ -603,137 +907,423 @@ def add_child_item(item_id, **kwargs):
         return create_error_response("An unexpected error occurred", 500)
 
 
-@inventory_blueprint.route("/<int:item_id>", methods=["PUT"])
+def parse_import_csv(text: str):
+    """
+    Converts a CSV file where each row is an item into the same structure as
+    a JSON import. Rows that have a "parentBarcode" are added as children of
+    the row with that barcode. Raises a ValueError if a parent can't be found.
+    """
+    entries = []
+    entries_by_barcode = {}
+
+    for line, row in enumerate(csv.DictReader(StringIO(text)), start=2):
+        # Empty cells should be inserted as NULL
+        row = {key: value if value != "" else None for key, value in row.items()}
+
+        for key in ("available", "moveable"):
+            if row.get(key) and row[key].lower() in CSV_BOOLEANS:
+                row[key] = CSV_BOOLEANS[row[key].lower()]
+
+        parent_barcode = row.pop("parentBarcode", None)
+
+        if parent_barcode is None:
+            row["children"] = []
+            entries.append(row)
+            entries_by_barcode[row.get("barcode")] = row
+        elif parent_barcode in entries_by_barcode:
+            entries_by_barcode[parent_barcode]["children"].append(row)
+        else:
+            raise ValueError(
+                f"Row {line} has a parentBarcode that doesn't belong to an earlier row"
+            )
+
+    return entries
+
+
+def normalize_barcode(barcode) -> str:
+    """
+    Barcodes are compared case-insensitively by the database, so this is
+    used to compare them the same way in Python
+    """
+    return str(barcode).casefold()
+
+
+def validate_import(entries: list):
+    """
+    Parses every entry of an import and returns a list of parsed entries along
+    with a list containing the error for every invalid entry (or None if the
+    entry is valid).
+    """
+    parsed_entries = []
+    errors = []
+    barcodes = set()
+
+    for entry in entries:
+        try:
+            if not isinstance(entry, dict):
+                raise TypeError("Item must be an object")
+
+            children = entry.get("children") or []
+
+            if not isinstance(children, list) or not all(
+                isinstance(child, dict) for child in children
+            ):
+                raise TypeError("Children must be objects")
+
+            # Empty CSV cells and JSON nulls shouldn't count as values
+            # for parameters that are required
+            for data, fields in [(entry, REQUIRED_ITEM_FIELDS)] + [
+                (child, REQUIRED_CHILD_FIELDS) for child in children
+            ]:
+                missing = [field for field in fields if data.get(field) is None]
+
+                if missing:
+                    raise KeyError(missing[0])
+
+            item_values, item_child_values = parse_item_values(entry)
+            children = [
+                parse_item_child_values(child, main=False) for child in children
+            ]
+
+            barcode = normalize_barcode(item_values["barcode"])
+
+            if barcode in barcodes:
+                raise ValueError(f"Duplicate barcode {item_values['barcode']}")
+
+            barcodes.add(barcode)
+            parsed_entries.append((item_values, item_child_values, children))
+            errors.append(None)
+        except KeyError as err:
+            parsed_entries.append(None)
+            errors.append(f"Parameter {err.args[0]} is required")
+        except (TypeError, ValueError, OverflowError) as err:
+            parsed_entries.append(None)
+            errors.append(str(err))
+
+    return parsed_entries, errors
+
+
+@inventory_blueprint.route("/import", methods=["POST"])
 @require_roles(["admin", "super"])
 @Database.with_connection()
-def update_item(item_id, **kwargs):
+def import_items(**kwargs):
+    """
+    Creates many main items and their children at once. The body can either be
+    a JSON array of items in the format that add_item takes, where each item can
+    have a "children" array of items in the format that add_child_item takes, or
+    a CSV file (with the content type text/csv) where each row is an item. Child
+    rows in a CSV file need to set "parentBarcode" to the barcode of their main item.
+
+    Every item is validated before anything is inserted. Items are then inserted
+    in chunks, where each chunk is its own transaction, and the result of each
+    item is returned in the same order they were given.
+    """
     cursor = kwargs["cursor"]
     connection = kwargs["connection"]
 
-    put_data = request.get_json()
+    if request.mimetype == "text/csv":
+        try:
+            entries = parse_import_csv(request.get_data(as_text=True))
+        except (csv.Error, ValueError) as err:
+            return create_error_response(str(err), 400)
+    else:
+        entries = request.get_json()
 
-    if not put_data:
-        return create_error_response("A body is required", 400)
+    if not isinstance(entries, list) or not entries:
+        return create_error_response("A list of items is required", 400)
 
-    # Values from the 'itemChild' table
-    name = put_data.get("name")
-    description = put_data.get("description")
-    item_type = put_data.get("type")
-    serial = put_data.get("serial")
-    vendor_name = put_data.get("vendorName")
-    vendor_price = put_data.get("vendorPrice")
-    purchase_date = put_data.get("purchaseDate")
+    if len(entries) > MAX_IMPORT_SIZE:
+        return create_error_response(
+            f"At most {MAX_IMPORT_SIZE} items can be imported at once", 400
+        )
 
-    # Values from the 'item' table
-    barcode = put_data.get("barcode")
-    available = put_data.get("available")
-    moveable = put_data.get("moveable")
-    location = put_data.get("location")
-    quantity = put_data.get("quantity")
+    parsed_entries, errors = validate_import(entries)
 
     try:
-        if name is not None:
-            cursor.execute(
-                "UPDATE itemChild SET name = %s WHERE ID = %s", (name, item_id)
-            )
+        # Barcodes are assumed to be unique, so items whose barcode is already
+        # in use can't be imported
+        barcodes = [entry[0]["barcode"] for entry in parsed_entries if entry]
 
-        if description is not None:
+        for _, chunk in chunked(barcodes, IMPORT_CHUNK_SIZE):
             cursor.execute(
-                "UPDATE itemChild SET description = %s WHERE ID = %s",
-                (description, item_id),
+                f"SELECT barcode FROM item WHERE barcode IN ({create_placeholders(chunk)})",
+                chunk,
             )
+            existing_barcodes = {
+                normalize_barcode(row["barcode"]) for row in cursor.fetchall()
+            }
 
-        if item_type is not None:
-            cursor.execute(
-                "UPDATE itemChild SET type = %s WHERE ID = %s", (item_type, item_id)
-            )
+            for position, entry in enumerate(parsed_entries):
+                if (
+                    entry
+                    and normalize_barcode(entry[0]["barcode"]) in existing_barcodes
+                ):
+                    errors[
+                        position
+                    ] = f"Barcode {entry[0]['barcode']} is already in use"
+    except mysql.connector.Error as err:
+        current_app.logger.exception(str(err))
+        return create_error_response("An unexpected error occurred", 500)
 
-        if serial is not None:
-            cursor.execute(
-                "UPDATE itemChild SET serial = %s WHERE ID = %s", (serial, item_id)
-            )
+    if any(errors):
+        results = [
+            {"index": index, "status": "invalid", "error": error}
+            for index, error in enumerate(errors)
+            if error
+        ]
+        return jsonify({"error": "Some items are invalid", "results": results}), 400
 
-        if vendor_name is not None:
-            cursor.execute(
-                "UPDATE itemChild SET vendorName = %s WHERE ID = %s",
-                (vendor_name, item_id),
-            )
+    results = []
+    imported_item_ids = []
 
-        if vendor_price is not None and vendor_price != "":
-            cursor.execute(
-                "UPDATE itemChild SET vendorPrice = %s WHERE ID = %s",
-                (vendor_price, item_id),
-            )
+    for index, chunk in chunked(parsed_entries, IMPORT_CHUNK_SIZE):
+        barcodes = [item_values["barcode"] for item_values, _, _ in chunk]
 
-        if purchase_date is not None:
-            purchase_date = convert_javascript_date(purchase_date)
-            cursor.execute(
-                "UPDATE itemChild SET purchaseDate = %s WHERE ID = %s",
-                (purchase_date, item_id),
-            )
+        try:
+            cursor.executemany(INSERT_ITEM_QUERY, [entry[0] for entry in chunk])
 
-        if barcode is not None:
+            # executemany doesn't return the ID of every row it inserts, so the
+            # new IDs are looked up by their (unique) barcodes instead
             cursor.execute(
-                """
-                UPDATE item SET barcode = %s
-                WHERE ID = (SELECT item from itemChild WHERE ID = %s)
+                f"""
+                SELECT ID, barcode FROM item
+                WHERE barcode IN ({create_placeholders(barcodes)})
                 """,
-                (barcode, item_id),
+                barcodes,
             )
+            item_ids = {str(row["barcode"]): row["ID"] for row in cursor.fetchall()}
+            item_child_values = []
+
+            for item_values, main_values, children in chunk:
+                item_id = item_ids[str(item_values["barcode"])]
 
-        if available is not None:
+                for values in [main_values] + children:
+                    values["item_id"] = item_id
+                    item_child_values.append(values)
+
+            cursor.executemany(INSERT_ITEM_CHILD_QUERY, item_child_values)
+
+            chunk_item_ids = list(item_ids.values())
             cursor.execute(
-                """
-                UPDATE item SET available = %s
-                WHERE ID = (SELECT item from itemChild WHERE ID = %s)
+                f"""
+                SELECT ID, item FROM itemChild
+                WHERE main = 1 AND item IN ({create_placeholders(chunk_item_ids)})
                 """,
-                (int(available), item_id),
+                chunk_item_ids,
             )
+            main_ids = {row["item"]: row["ID"] for row in cursor.fetchall()}
+
+            connection.commit()
+
+            for position, (item_values, _, _) in enumerate(chunk, start=index):
+                item_id = item_ids[str(item_values["barcode"])]
+                imported_item_ids.append(item_id)
+                results.append(
+                    {
+                        "index": position,
+                        "status": "created",
+                        "ID": main_ids[item_id],
+                        "item": item_id,
+                    }
+                )
+        except mysql.connector.Error as err:
+            current_app.logger.exception(str(err))
+            connection.rollback()
+
+            for position in range(index, index + len(chunk)):
+                results.append(
+                    {
+                        "index": position,
+                        "status": "failed",
+                        "error": "An unexpected error occurred",
+                    }
+                )
+
+    if imported_item_ids:
+        ResourceVersions.bump("inventory")
+        ItemChanges.record(*imported_item_ids)
+
+    return jsonify({"results": results})
+
+
+def parse_item_update(data: dict):
+    """
+    Takes the body of a request to update an item and returns two dicts that
+    map columns to their new values: one for the itemChild table and one for
+    the item table. Parameters that are missing or null aren't updated.
+    """
+    item_child_values = {}
+    item_values = {}
+
+    # Values from the 'itemChild' table
+    for column in ("name", "description", "type", "serial", "vendorName"):
+        if data.get(column) is not None:
+            item_child_values[column] = data[column]
+
+    if data.get("vendorPrice") is not None and data["vendorPrice"] != "":
+        item_child_values["vendorPrice"] = data["vendorPrice"]
+
+    if data.get("purchaseDate") is not None:
+        item_child_values["purchaseDate"] = convert_javascript_date(
+            data["purchaseDate"]
+        )
+
+    # Values from the 'item' table
+    for column in ("barcode", "location"):
+        if data.get(column) is not None:
+            item_values[column] = data[column]
+
+    for column in ("available", "moveable"):
+        if data.get(column) is not None:
+            item_values[column] = int(data[column])
+
+    # Quantity is a special case. If the quantity is 0, the item's status should
+    # be marked as unavailable. If the quantity is > 0, the item's status should
+    # be marked as available
+    if data.get("quantity") is not None:
+        item_values["quantity"] = data["quantity"]
+        item_values["available"] = 0 if data["quantity"] == 0 else 1
+
+    return item_child_values, item_values
+
+
+def create_update_query(table: str, values: dict, ids: list):
+    """
+    Creates a single UPDATE statement that sets every column in "values" for
+    every row in "ids" and returns it along with its parameters. Column names
+    must come from parse_item_update since they're added to the query directly.
+    """
+    assignments = ", ".join(f"{column} = %s" for column in values)
+    query = f"UPDATE {table} SET {assignments} WHERE ID IN ({create_placeholders(ids)})"
+
+    return query, list(values.values()) + list(ids)
+
+
+@inventory_blueprint.route("/<int:item_id>", methods=["PUT"])
+@require_roles(["admin", "super"])
+@Database.with_connection()
+def update_item(item_id, **kwargs):
+    cursor = kwargs["cursor"]
+    connection = kwargs["connection"]
+
+    put_data = request.get_json()
+
+    if not put_data:
+        return create_error_response("A body is required", 400)
 
-        if moveable is not None:
+    try:
+        item_child_values, item_values = parse_item_update(put_data)
+    except (TypeError, ValueError) as err:
+        return create_error_response(str(err), 400)
+
+    try:
+        cursor.execute("SELECT item FROM itemChild WHERE ID = %s", (item_id,))
+        item = cursor.fetchall()
+
+        if not item:
+            return create_error_response("Item not found", 404)
+
+        # Each table gets at most one UPDATE no matter how many columns changed
+        if item_child_values:
             cursor.execute(
-                """
-                UPDATE item SET moveable = %s
-                WHERE ID = (SELECT item from itemChild WHERE ID = %s)
-                """,
-                (int(moveable), item_id),
+                *create_update_query("itemChild", item_child_values, [item_id])
             )
 
-        if location is not None:
-            cursor.execute(
-                """
-                UPDATE item SET location = %s
-                WHERE ID = (SELECT item from itemChild WHERE ID = %s)
-                """,
-                (location, item_id),
+        if item_values:
+            cursor.execute(*create_update_query("item", item_values, [item[0]["item"]]))
+
+        connection.commit()
+        ResourceVersions.bump("inventory")
+        ItemChanges.record(item[0]["item"])
+    except mysql.connector.errors.Error as err:
+        connection.rollback()
+        current_app.log_exception(str(err))
+        return create_error_response("An unexpected error occurred", 500)
+
+    return jsonify({"status": "Success"})
+
+
+@inventory_blueprint.route("/batch", methods=["PATCH"])
+@require_roles(["admin", "super"])
+@Database.with_connection()
+def update_items(**kwargs):
+    """
+    Updates many items in a single transaction. The body is a list of objects
+    that each have the "ID" of an itemChild along with any of the parameters
+    that update_item takes. Items that get the exact same changes (for instance,
+    moving a lot of items to the same location) are updated together with one
+    statement per table.
+    """
+    cursor = kwargs["cursor"]
+    connection = kwargs["connection"]
+
+    updates = request.get_json()
+
+    if not isinstance(updates, list) or not updates:
+        return create_error_response("A list of items is required", 400)
+
+    if len(updates) > MAX_BATCH_SIZE:
+        return create_error_response(
+            f"At most {MAX_BATCH_SIZE} items can be updated at once", 400
+        )
+
+    parsed_updates = []
+
+    for index, update in enumerate(updates):
+        try:
+            parsed_updates.append((int(update["ID"]), *parse_item_update(update)))
+        except KeyError as err:
+            return create_error_response(
+                f"Parameter {err.args[0]} is required (item {index})", 400
             )
+        except (TypeError, ValueError) as err:
+            return create_error_response(f"Invalid item {index}: {err}", 400)
 
-        # Quantity is a special case. If the quantity is 0, the item's status should
-        # be marked as unavailable. If the quantity is > 0, the item's status should
-        # be marked as available
-        if quantity is not None:
-            values = {
-                "quantity": quantity,
-                "item_id": item_id,
-                "available": 0 if quantity == 0 else 1,
-            }
+    item_child_ids = list({item_child_id for item_child_id, _, _ in parsed_updates})
 
-            cursor.execute(
-                """
-                UPDATE item
-                SET quantity = %(quantity)s, available = %(available)s
-                WHERE ID = (SELECT item from itemChild WHERE ID = %(item_id)s)
-                """,
-                values,
+    try:
+        cursor.execute(
+            f"""
+            SELECT ID, item FROM itemChild
+            WHERE ID IN ({create_placeholders(item_child_ids)})
+            """,
+            item_child_ids,
+        )
+        item_ids = {row["ID"]: row["item"] for row in cursor.fetchall()}
+        missing_ids = [str(ID) for ID in item_child_ids if ID not in item_ids]
+
+        if missing_ids:
+            return create_error_response(
+                f"Items not found: {', '.join(missing_ids)}", 404
             )
 
+        # Group the rows of each table by the exact changes they get. The values
+        # can come straight from JSON so they aren't always hashable, which is
+        # why their repr is used as the key instead.
+        groups = {}
+
+        for item_child_id, item_child_values, item_values in parsed_updates:
+            for table, values, row_id in [
+                ("itemChild", item_child_values, item_child_id),
+                ("item", item_values, item_ids[item_child_id]),
+            ]:
+                if values:
+                    key = (table, repr(sorted(values.items())))
+                    groups.setdefault(key, (table, values, []))[2].append(row_id)
+
+        for table, values, ids in groups.values():
+            for _, chunk in chunked(list(dict.fromkeys(ids)), MAX_BATCH_SIZE):
+                cursor.execute(*create_update_query(table, values, chunk))
+
         connection.commit()
+        ResourceVersions.bump("inventory")
+        ItemChanges.record(*set(item_ids.values()))
     except mysql.connector.errors.Error as err:
         connection.rollback()
         current_app.log_exception(str(err))
         return create_error_response("An unexpected error occurred", 500)
 
-    return jsonify({"status": "Success"})
+    return jsonify({"status": "Success", "updated": len(item_child_ids)})
 
 
 @inventory_blueprint.route("/<int:item_id>/retire", methods=["PUT"])
@@ -770,6 +1360,8 @@ def retire_item(item_id, **kwargs):
         cursor.execute("UPDATE item SET retiredDateTime = %s WHERE ID = %s", params)
 
         connection.commit()
+        ResourceVersions.bump("inventory")
+        ItemChanges.record(item["item"])
 
         return jsonify({"status": "Success"})
     except mysql.connector.errors.Error as err:
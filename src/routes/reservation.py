@@ -3,17 +3,36 @@ import mysql.connector
 from util.database import Database
 from flask import Blueprint, current_app, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from util.ics import create_calendar_for_reservation
+from util.ics import (
+    create_calendar_for_reservations,
+    create_ics_attachment,
+    hash_feed_token,
+)
 from util.response import create_error_response, convert_javascript_date
-from util.request import require_roles
+from util.request import parse_limit_parameter, require_roles, with_etag
+from util.versioning import ItemChanges, ResourceVersions, UserReservationChanges
+from util.cache import CalendarCache
+from util.catalog import ITEM_SELECT_QUERY, create_placeholders, load_item_documents
+from util.stock import CHECKED_OUT_STATUSES, check_out_unit, return_unit
 
 from util.email import Emailer
-from smtplib import SMTPException
-import os
+from datetime import datetime
+from typing import List, Optional, Tuple
+import base64
+import hashlib
+import json
 
 
 reservation_blueprint = Blueprint("reservation", __name__)
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+RESERVATION_SORTS = {"startDateTime": "ASC", "-startDateTime": "DESC"}
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Reservations with these statuses are holding (or are waiting to hold) a unit
+ACTIVE_RESERVATION_STATUSES = {"approved", "checked out", "late", "pending"}
+
 VALID_RESERVATION_STATUSES = {
     "approved",
     "cancelled",
@@ -26,6 +45,73 @@ VALID_RESERVATION_STATUSES = {
 }
 
 
+def hydrate_reservations(cursor, reservations: List[dict]) -> List[dict]:
+    """
+    Replaces the item, user, and admin IDs of each reservation (rows from the
+    reservation table) with the item, user, and admin they refer to. This uses
+    "cursor" so it can see reservations that haven't been committed yet.
+    """
+    if not reservations:
+        return reservations
+
+    # Instead of querying the item, user, and admin of every reservation one
+    # at a time, everything referenced by any reservation is loaded in a few
+    # batched queries and then matched up with each reservation
+    item_ids = list({reservation["item"] for reservation in reservations})
+    cursor.execute(
+        ITEM_SELECT_QUERY
+        + f"WHERE A.main = 1 AND A.item IN ({create_placeholders(item_ids)})",
+        item_ids,
+    )
+    items = {
+        item["item"]: item for item in load_item_documents(cursor, cursor.fetchall())
+    }
+
+    user_ids = list(
+        {reservation["user"] for reservation in reservations}
+        | {
+            reservation["userAdminID"]
+            for reservation in reservations
+            if reservation["userAdminID"] is not None
+        }
+    )
+    cursor.execute(
+        f"""
+        SELECT ID, email, verified, role, created, fullName
+        FROM users
+        WHERE ID IN ({create_placeholders(user_ids)})
+        """,
+        user_ids,
+    )
+    users = {}
+
+    for user in cursor.fetchall():
+        user["verified"] = bool(user["verified"])
+        users[user["ID"]] = user
+
+    # For every reservation, we'll need to replace the item id,
+    # user id, and admin id with the actual values in the database
+    for reservation in reservations:
+        reservation["item"] = items.get(reservation["item"])
+
+        if reservation["user"] in users:
+            reservation["user"] = users[reservation["user"]]
+
+        # Only users who are admins can be the admin of a reservation
+        admin = users.get(reservation["userAdminID"])
+
+        if admin and admin["role"].lower() in ("admin", "super"):
+            reservation["admin"] = admin
+        else:
+            reservation["admin"] = None
+
+        # Since this filed can be accesse through the nested admin object,
+        # we no longer need this property
+        del reservation["userAdminID"]
+
+    return reservations
+
+
 @Database.with_connection()
 def query_reservations(
     base_query: str, variables: dict = {}, use_jsonify=True, **kwargs
@@ -43,111 +129,196 @@ def query_reservations(
 
     try:
         cursor.execute(base_query, variables)
-        reservations = cursor.fetchall()
+        reservations = hydrate_reservations(cursor, cursor.fetchall())
 
-        # For every reservation, we'll need to replace the item id,
-        # user id, and admin id with the actual values in the database
-        for reservation in reservations:
-            query = """
-                SELECT
-                    A.*, B.barcode, B.available, B.moveable, B.location,
-                    B.quantity, B.retiredDateTime
-                FROM itemChild AS A
-                LEFT JOIN item AS B on A.item = B.ID
-                WHERE A.item = %(item_id)s
-                UNION
-                SELECT
-                    A.*, B.barcode, B.available, B.moveable, B.location,
-                    B.quantity, B.retiredDateTime
-                FROM itemChild AS A
-                LEFT JOIN item AS B on A.item = B.ID
-                WHERE A.item = %(item_id)s
-            """
-            cursor.execute(query, {"item_id": reservation["item"]})
+        return jsonify(reservations) if use_jsonify else reservations
+    except mysql.connector.Error as err:
+        current_app.logger.exception(str(err))
+    return create_error_response("An unexpected error occurred", 500)
 
-            # Replace the reservation's item field with the actual item data
-            # from the database
-            items = cursor.fetchall()
 
-            for item in items:
-                item["moveable"] = bool(item["moveable"])
-                item["available"] = bool(item["available"])
-                item["main"] = bool(item["main"])
+def encode_reservation_cursor(reservation: dict) -> str:
+    """
+    Creates the opaque cursor that's handed to clients so they can request the
+    page of reservations that comes after "reservation"
+    """
+    start = reservation["startDateTime"].strftime("%Y-%m-%d %H:%M:%S")
+    payload = json.dumps({"start": start, "id": reservation["ID"]}).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii")
 
-                cursor.execute(
-                    "SELECT * from itemImage WHERE itemChild = %s", (item["ID"],)
-                )
 
-                item["images"] = cursor.fetchall()
+def decode_reservation_cursor(page_cursor: str) -> Tuple[str, int]:
+    """
+    Returns the start date and ID stored in a cursor created by
+    encode_reservation_cursor. Raises ValueError if the cursor is malformed.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(page_cursor.encode("ascii")))
+        start = convert_javascript_date(payload["start"])
+        last_id = payload["id"]
+    except Exception as err:
+        raise ValueError("Invalid cursor") from err
 
-            # Using next here to find the first reservation that matches this condition
-            main_item = next((item for item in items if bool(item["main"])), None)
-            main_item["children"] = [item for item in items if not bool(item["main"])]
+    if not isinstance(last_id, int):
+        raise ValueError("Invalid cursor")
 
-            reservation["item"] = main_item
+    return start, last_id
 
-            # Replace the reservation's user field with the actual user data
-            # from the database
-            cursor.execute(
-                """
-                SELECT ID, email, verified, role, created, fullName
-                FROM users
-                WHERE ID = %s
-                LIMIT 1
-                """,
-                (reservation["user"],),
+
+def parse_date_parameter(name: str) -> Optional[str]:
+    """
+    Converts the query parameter "name", which can either be a JavaScript
+    timestamp or a date string, to a date that can be used in a query.
+    Raises ValueError if it isn't a valid date.
+    """
+    value = request.args.get(name, default="", type=str)
+
+    if not value:
+        return None
+
+    try:
+        return convert_javascript_date(int(value) if value.isdigit() else value)
+    except (ValueError, OverflowError, OSError) as err:
+        raise ValueError(f"Parameter {name} must be a valid date") from err
+
+
+def find_reservations(conditions: List[str], variables: dict, hide_users=False):
+    """
+    Selects the reservations matching "conditions" (SQL conditions that use the
+    named parameters in "variables") along with the filters in the request's
+    query parameters:
+
+    - status: a comma separated list of statuses
+    - from/to: only include reservations that start on or after "from" and
+      before "to". Either can be a JavaScript timestamp or a date string.
+    - sort: "startDateTime" (the default when paginating) or "-startDateTime"
+    - limit/cursor: if either is passed, a single page of at most "limit"
+      reservations is returned along with a cursor to the next page. Otherwise,
+      every matching reservation is returned.
+
+    These queries are covered by the (status, startDateTime), (user,
+    startDateTime) and (item, startDateTime) indexes, so they only read the
+    reservations in the requested window. If "hide_users" is true, the user
+    and admin of each reservation are left out.
+    """
+    conditions = list(conditions)
+    variables = dict(variables)
+    statuses = request.args.get("status", default="", type=str)
+    sort = request.args.get("sort", default="", type=str)
+    paginate = "limit" in request.args or "cursor" in request.args
+
+    if statuses:
+        statuses = [status.strip().lower() for status in statuses.split(",")]
+
+        if not set(statuses) <= VALID_RESERVATION_STATUSES:
+            valid_statuses = ", ".join(sorted(VALID_RESERVATION_STATUSES))
+            return create_error_response(
+                f"Parameter status must only contain {valid_statuses}", 400
             )
 
-            user = cursor.fetchone()
-
-            if user:
-                user["verified"] = bool(user["verified"])
-                reservation["user"] = user
-
-            # Replace the reservation's admin field with the actual user data from the
-            # database (if there is an admin who has updated this reservation's status)
-            if reservation["userAdminID"] is not None:
-                cursor.execute(
-                    """
-                    SELECT ID, email, verified, role, created, fullName
-                    FROM users
-                    WHERE ID = %s AND (role = 'Admin' OR role = 'Super')
-                    LIMIT 1
-                    """,
-                    (reservation["userAdminID"],),
+        names = [f"status_{index}" for index in range(len(statuses))]
+        conditions.append(f"status IN ({', '.join(f'%({name})s' for name in names)})")
+        variables.update(zip(names, statuses))
+
+    try:
+        start = parse_date_parameter("from")
+        end = parse_date_parameter("to")
+    except ValueError as err:
+        return create_error_response(str(err), 400)
+
+    if start:
+        conditions.append("startDateTime >= %(from)s")
+        variables["from"] = start
+
+    if end:
+        conditions.append("startDateTime < %(to)s")
+        variables["to"] = end
+
+    if sort and sort not in RESERVATION_SORTS:
+        return create_error_response(
+            f"Parameter sort must be one of {', '.join(RESERVATION_SORTS)}", 400
+        )
+
+    if paginate and not sort:
+        sort = "startDateTime"
+
+    if paginate:
+        try:
+            limit = parse_limit_parameter(DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        except ValueError as err:
+            return create_error_response(str(err), 400)
+
+        if request.args.get("cursor"):
+            try:
+                cursor_start, cursor_id = decode_reservation_cursor(
+                    request.args["cursor"]
+                )
+            except ValueError:
+                return create_error_response("Invalid cursor", 400)
+
+            # MySQL doesn't use an index range for a row comparison like
+            # (startDateTime, ID) > (...), so it's spelled out. The first
+            # condition is redundant, but it gives the range a starting point.
+            comparison = ">" if RESERVATION_SORTS[sort] == "ASC" else "<"
+            conditions.append(
+                f"""
+                startDateTime {comparison}= %(cursor_start)s AND (
+                    startDateTime {comparison} %(cursor_start)s
+                    OR (startDateTime = %(cursor_start)s AND ID {comparison} %(cursor_id)s)
                 )
-                admin = cursor.fetchone()
+                """
+            )
+            variables["cursor_start"] = cursor_start
+            variables["cursor_id"] = cursor_id
 
-                if admin:
-                    admin["verified"] = bool(admin["verified"])
-                    reservation["admin"] = admin
-                else:
-                    reservation["admin"] = None
-            else:
-                reservation["admin"] = None
+    query = "SELECT * FROM reservation"
 
-            # Since this filed can be accesse through the nested admin object,
-            # we no longer need this property
-            del reservation["userAdminID"]
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
 
-        return jsonify(reservations) if use_jsonify else reservations
-    except mysql.connector.Error as err:
-        current_app.logger.exception(str(err))
-    return create_error_response("An unexpected error occurred", 500)
+    if sort:
+        direction = RESERVATION_SORTS[sort]
+        query += f" ORDER BY startDateTime {direction}, ID {direction}"
+
+    if paginate:
+        # Fetch one extra row so we know whether there's another page
+        query += " LIMIT %(limit)s"
+        variables["limit"] = limit + 1
+
+    reservations = query_reservations(query, variables, use_jsonify=False)
+
+    if not isinstance(reservations, list):
+        # An error response
+        return reservations
+
+    # Prevent normal users from viewing the user and admin associated
+    # with a reservation. That information should only be available to admins
+    if hide_users:
+        for reservation in reservations:
+            del reservation["user"]
+            del reservation["admin"]
+
+    if not paginate:
+        return jsonify(reservations)
+
+    next_cursor = None
+
+    if len(reservations) > limit:
+        reservations = reservations[:limit]
+        next_cursor = encode_reservation_cursor(reservations[-1])
+
+    return jsonify({"reservations": reservations, "nextCursor": next_cursor})
 
 
 @reservation_blueprint.route("/", methods=["GET"])
 @require_roles(["admin", "super"])
+@with_etag("reservations", "inventory", "users")
 def get_all_reservations():
-    status = request.args.get("status", default="", type=str)
-
-    if status:
-        return query_reservations(
-            "SELECT * FROM reservation WHERE status = %(status)s",
-            variables={"status": status},
-        )
-
-    return query_reservations("SELECT * FROM reservation")
+    """
+    Returns every reservation. See find_reservations for the query parameters
+    that can be used to filter and paginate them.
+    """
+    return find_reservations([], {})
 
 
 @reservation_blueprint.route("/user/<int:user_id>", methods=["GET"])
@@ -161,10 +332,7 @@ def get_reservations_by_user(user_id):
             "You don't have permission to view this resource", 403
         )
 
-    return query_reservations(
-        "SELECT * FROM reservation WHERE user = %(user_id)s",
-        variables={"user_id": user_id},
-    )
+    return find_reservations(["user = %(user_id)s"], {"user_id": user_id})
 
 
 @reservation_blueprint.route("/item/<int:item_id>", methods=["GET"])
@@ -172,21 +340,12 @@ def get_reservations_by_user(user_id):
 def get_reservations_by_item(item_id):
     jwt_user = get_jwt_identity()
 
-    reservations = query_reservations(
-        "SELECT * FROM reservation WHERE item = %(item_id)s",
-        variables={"item_id": item_id},
-        use_jsonify=False,
+    return find_reservations(
+        ["item = %(item_id)s"],
+        {"item_id": item_id},
+        hide_users=jwt_user["role"].lower() == "user",
     )
 
-    # Prevent normal users from viewing the user and admin associated
-    # with a reservation. That information should only be available to admins
-    if jwt_user["role"].lower() == "user":
-        for reservation in reservations:
-            del reservation["user"]
-            del reservation["admin"]
-
-    return jsonify(reservations)
-
 
 @reservation_blueprint.route("/<int:reservation_id>", methods=["GET"])
 @require_roles(["admin", "super"])
@@ -197,6 +356,84 @@ def get_reservations_by_id(reservation_id):
     )
 
 
+def get_peak_overlap(intervals: List[Tuple[datetime, datetime]]) -> int:
+    """
+    Returns the largest number of intervals that overlap at any one time.
+    Intervals are half open, so one that ends when another starts doesn't
+    overlap it.
+    """
+    # At the same time, ends (-1) are sorted before starts (1)
+    events = sorted(
+        [(start, 1) for start, _ in intervals] + [(end, -1) for _, end in intervals]
+    )
+    current = peak = 0
+
+    for _, change in events:
+        current += change
+        peak = max(peak, current)
+
+    return peak
+
+
+def has_capacity(cursor, item: dict, reservation: dict) -> bool:
+    """
+    Checks whether there's a unit of "item" (a row from the item table with its
+    quantity) free for the whole time requested by "reservation". The item's
+    row should already be locked so the answer can't change before the
+    reservation is inserted, and locked by the first statement of the
+    transaction so these reads see every reservation committed before it.
+    """
+    # Units that are checked out (including late ones) stay off the shelf until
+    # they're returned, no matter when their reservation was meant to end, so
+    # they're already left out of the quantity. Only the reservations that
+    # haven't been checked out yet need to fit in the units that are left.
+    # Past reservations have all ended before the new one starts, so the range
+    # on endDateTime means only current and future reservations are read from
+    # the (item, endDateTime) index no matter how much history the item has.
+    statuses = list(ACTIVE_RESERVATION_STATUSES - CHECKED_OUT_STATUSES)
+    cursor.execute(
+        f"""
+        SELECT startDateTime, endDateTime FROM reservation
+        WHERE item = %s
+        AND endDateTime > %s
+        AND startDateTime < %s
+        AND status IN ({create_placeholders(statuses)})
+        """,
+        (
+            item["ID"],
+            reservation["start_date_time"],
+            reservation["end_date_time"],
+            *statuses,
+        ),
+    )
+    start = datetime.strptime(reservation["start_date_time"], DATE_FORMAT)
+    end = datetime.strptime(reservation["end_date_time"], DATE_FORMAT)
+
+    # Only the part of each reservation within the requested time matters
+    intervals = [
+        (max(row["startDateTime"], start), min(row["endDateTime"], end))
+        for row in cursor.fetchall()
+    ]
+
+    return get_peak_overlap(intervals) < item["quantity"]
+
+
+def queue_confirmation_email(cursor, reservation: dict, recipient: str, body: str):
+    """
+    Queues an email to "recipient" with a calendar event for "reservation" (a
+    reservation from hydrate_reservations) attached
+    """
+    Emailer.queue_email(
+        cursor,
+        recipient,
+        "CHDR Item Reservation Confirmation",
+        body,
+        create_ics_attachment(reservation),
+        cc=secrets["EMAIL_USERNAME"],
+        attachment_name=f"{reservation['ID']}.ics",
+    )
+
+
 @reservation_blueprint.route("/", methods=["POST"])
 @jwt_required()
 @Database.with_connection()
@@ -248,11 +485,26 @@ def create_reservation(**kwargs):
         current_app.logger.exception(str(err))
         return create_error_response("An unexpected error occurred", 500)
 
+    if reservation["end_date_time"] <= reservation["start_date_time"]:
+        return create_error_response("The reservation must end after it starts", 400)
+
     try:
-        cursor.execute("SELECT ID from item WHERE ID = %s", (reservation["item"],))
-        result = cursor.fetchone()
+        # The reads above started a transaction, and under REPEATABLE READ its
+        # snapshot would hide reservations committed while this request waits
+        # for the lock below. Ending it here means the lock is taken first and
+        # every read after it sees what was committed before the lock.
+        connection.rollback()
+
+        # Locking the item's row makes concurrent requests for the same item
+        # wait for this one to commit, so they can't both take the last unit
+        cursor.execute(
+            "SELECT ID, quantity FROM item WHERE ID = %s FOR UPDATE",
+            (reservation["item"],),
+        )
+        item = cursor.fetchall()
 
-        if result is None:
+        if not item:
+            connection.rollback()
             return create_error_response("Invalid item ID", 400)
 
         cursor.execute(
@@ -266,11 +518,19 @@ def create_reservation(**kwargs):
         reservations = cursor.fetchall()
 
         for res in reservations:
-            if res["status"].lower() in {"approved", "checked out", "late", "pending"}:
+            if res["status"].lower() in ACTIVE_RESERVATION_STATUSES:
+                connection.rollback()
                 return create_error_response(
                     "You already have a reservation for this item", 409
                 )
 
+        if reservation["status"].lower() in ACTIVE_RESERVATION_STATUSES:
+            if not has_capacity(cursor, item[0], reservation):
+                connection.rollback()
+                return create_error_response(
+                    "This item is fully booked during the requested time", 409
+                )
+
         query = """
             INSERT INTO reservation (
                 item,
@@ -291,69 +551,41 @@ def create_reservation(**kwargs):
         """
 
         cursor.execute(query, reservation)
-        connection.commit()
+        row_id = cursor.lastrowid
 
-        reservations = query_reservations(
-            "SELECT * FROM reservation WHERE ID = %(row_id)s",
-            variables={"row_id": cursor.lastrowid},
-            use_jsonify=False,
-        )
-
-        # Makes sure to update the quantity when an item is checked out
+        # Makes sure to update the quantity when an item is checked out. This
+        # is part of the same transaction so other requests never see the
+        # reservation without the updated quantity.
         if reservation["status"].lower() == "checked out":
-            cursor.execute("SELECT quantity FROM item WHERE ID = %(item)s", reservation)
-            item = cursor.fetchone()
-
-            # Here, we need to check if the quantity is 1 because we're gonna decrement
-            # it right away. We need to check before we update the quantity because the
-            # change may not be reflected immediately
-            if item["quantity"] == 1:
-                cursor.execute(
-                    "UPDATE item SET available = 0 WHERE ID = %(item)s", reservation
-                )
-
-            cursor.execute(
-                "UPDATE item SET quantity = quantity - 1 WHERE ID = %(item)s",
-                reservation,
-            )
-
-            connection.commit()
+            if not check_out_unit(cursor, reservation["item"]):
+                connection.rollback()
+                return create_error_response("This item is out of stock", 409)
 
-        # BEGIN ICS
+        cursor.execute("SELECT * FROM reservation WHERE ID = %s", (row_id,))
+        created_reservation = hydrate_reservations(cursor, cursor.fetchall())[0]
 
+        # The confirmation is queued in the same transaction so it's only
+        # sent if the reservation is created
         if reservation["status"].lower() in {"approved", "checked out"}:
-            res = reservations[0]
-            res_id = res["ID"]
-            calendar = create_calendar_for_reservation(res)
-            ics_path = f"{res_id}.ics"
-            email_body = """
+            queue_confirmation_email(
+                cursor,
+                created_reservation,
+                post_data["email"],
+                """
                 Your reservation has been created.
                 Use the attached file to add the reservation to your calendar.
-                """
-
-            user_email = post_data["email"]
-            with open(ics_path, "w") as f:
-                f.write(str(calendar))
-
-            try:
-                Emailer.send_email(
-                    user_email,
-                    "CHDR Item Reservation Confirmation",
-                    email_body,
-                    ics_path,
-                    cc=secrets["EMAIL_USERNAME"],
-                )
-            except SMTPException as e:
-                current_app.logger.error(e.message)
+                """,
+            )
 
-            try:
-                os.remove(ics_path)
-            except OSError as e:
-                current_app.logger.error(e.message)
+        connection.commit()
+        ResourceVersions.bump("reservations")
+        UserReservationChanges.record(reservation["user"])
 
-        # END ICS
+        if reservation["status"].lower() == "checked out":
+            ResourceVersions.bump("inventory")
+            ItemChanges.record(reservation["item"])
 
-        return reservations[0]
+        return created_reservation
     except mysql.connector.Error as err:
         current_app.logger.exception(str(err))
         return create_error_response("An unexpected error occurred", 500)
@@ -367,8 +599,13 @@ def delete_reservation(reservation_id, **kwargs):
     connection = kwargs["connection"]
 
     try:
+        cursor.execute("SELECT user FROM reservation WHERE ID = %s", (reservation_id,))
+        reservations = cursor.fetchall()
+
         cursor.execute("DELETE FROM reservation WHERE ID = %s", (reservation_id,))
         connection.commit()
+        ResourceVersions.bump("reservations")
+        UserReservationChanges.record(*[row["user"] for row in reservations])
     except mysql.connector.Error as err:
         current_app.logger.exception(str(err))
         return create_error_response("An unexpected error occurred", 500)
@@ -395,9 +632,14 @@ def update_status(reservation_id, **kwargs):
     end_date_time = post_data.get("endDateTime")
 
     try:
-        cursor.execute("SELECT user FROM reservation WHERE ID = %s", (reservation_id,))
+        cursor.execute(
+            "SELECT user, item FROM reservation WHERE ID = %s", (reservation_id,)
+        )
         uid = cursor.fetchone()
 
+        if uid is None:
+            return create_error_response("Reservation not found", 404)
+
         if jwt_user["role"].lower() == "user" and jwt_user["ID"] != uid["user"]:
             return create_error_response(
                 "You don't have permission to view this resource", 403
@@ -428,53 +670,28 @@ def update_status(reservation_id, **kwargs):
     }:
         fullSend = True
 
-    # If the item is checked out, we need to decrement the quantity
-    if status.lower() == "checked out":
+    try:
+        # Locking the reservation makes concurrent status changes to it wait for
+        # this one, so a unit is only ever checked out or returned once for it
         cursor.execute(
-            """
-            UPDATE item SET quantity = quantity - 1 WHERE ID = (
-                SELECT item FROM reservation WHERE ID = %s
-            )
-            """,
+            "SELECT status FROM reservation WHERE ID = %s FOR UPDATE",
             (reservation_id,),
         )
-        connection.commit()
+        previous_status = cursor.fetchall()[0]["status"].lower()
+        checked_out = previous_status in CHECKED_OUT_STATUSES
+        stock_changed = False
 
-        cursor.execute(
-            """
-            SELECT quantity FROM item WHERE ID = (
-                SELECT item FROM reservation WHERE ID = %s
-            )
-            """,
-            (reservation_id,),
-        )
+        if status.lower() == "checked out" and not checked_out:
+            if not check_out_unit(cursor, uid["item"]):
+                connection.rollback()
+                return create_error_response("This item is out of stock", 409)
 
-        updated_item = cursor.fetchone()
+            stock_changed = True
 
-        # Makes sure to mark the item as unavailable if the the item is no longer in stock
-        if updated_item["quantity"] == 0:
-            cursor.execute(
-                """
-                UPDATE item SET available = 0 WHERE ID = (
-                    SELECT item FROM reservation WHERE ID = %s
-                )
-                """,
-                (reservation_id,),
-            )
+        if status.lower() == "returned" and checked_out:
+            return_unit(cursor, uid["item"])
+            stock_changed = True
 
-    # Once the item has been returned, we need to increment the quantity again
-    if status.lower() == "returned":
-        cursor.execute(
-            """
-            UPDATE item
-            SET quantity = quantity + 1, available = 1
-            WHERE ID = (SELECT item FROM reservation WHERE ID = %s)
-            """,
-            (reservation_id,),
-        )
-        connection.commit()
-
-    try:
         cursor.execute(
             "UPDATE reservation SET status = %s WHERE ID = %s",
             (status, reservation_id),
@@ -498,54 +715,94 @@ def update_status(reservation_id, **kwargs):
                 (convert_javascript_date(end_date_time), reservation_id),
             )
 
+        cursor.execute("SELECT * FROM reservation WHERE ID = %s", (reservation_id,))
+        updated_reservation = hydrate_reservations(cursor, cursor.fetchall())[0]
+
+        if fullSend:
+            queue_confirmation_email(
+                cursor,
+                updated_reservation,
+                updated_reservation["user"]["email"],
+                "Use the attached file to add the Reservation to your calendar.",
+            )
+
         connection.commit()
+        ResourceVersions.bump("reservations")
+        UserReservationChanges.record(uid["user"])
+
+        if stock_changed:
+            ResourceVersions.bump("inventory")
+            ItemChanges.record(uid["item"])
     except mysql.connector.Error as err:
         current_app.logger.exception(str(err))
         return create_error_response("An unexpected error occurred", 500)
 
-    updated_reservations = query_reservations(
-        "SELECT * FROM reservation WHERE ID = %(row_id)s",
-        variables={"row_id": reservation_id},
-        use_jsonify=False,
-    )
+    return jsonify(updated_reservation)
 
-    # Safety check: this length of "updated_reservations" should always be 1
-    if len(updated_reservations) == 0:
-        return create_error_response("An unexpected error occurred", 500)
 
-    # BEGIN ICS
+@Database.with_connection()
+def find_calendar_user(token_hash: str, **kwargs) -> Optional[int]:
+    cursor = kwargs["cursor"]
 
-    if fullSend:
-        reservation = updated_reservations[0]
-        calendar = create_calendar_for_reservation(reservation)
-        ics_path = f"{reservation_id}.ics"
-        email_body = "Use the attached file to add the Reservation to your calendar."
+    cursor.execute("SELECT ID FROM users WHERE calendarToken = %s", (token_hash,))
+    users = cursor.fetchall()
 
-        uid = reservation["user"]["ID"]
-        query = f"SELECT email FROM users WHERE ID = {uid}"
-        cursor.execute(query)
-        user_email = cursor.fetchone()
-        user_email = user_email["email"]
+    return users[0]["ID"] if users else None
 
-        with open(ics_path, "w") as f:
-            f.write(str(calendar))
 
-        try:
-            Emailer.send_email(
-                user_email,
-                "CHDR Item Reservation Confirmation",
-                email_body,
-                ics_path,
-                cc=secrets["EMAIL_USERNAME"],
-            )
-        except SMTPException as e:
-            current_app.logger.error(e.message)
+@Database.with_connection()
+def render_calendar_feed(user_id: int, **kwargs) -> dict:
+    """
+    Creates the calendar feed of a user's active reservations, along with an
+    ETag for it and the IDs of the items it includes
+    """
+    cursor = kwargs["cursor"]
+    statuses = list(ACTIVE_RESERVATION_STATUSES)
+
+    cursor.execute(
+        f"""
+        SELECT * FROM reservation
+        WHERE user = %s AND status IN ({create_placeholders(statuses)})
+        """,
+        (user_id, *statuses),
+    )
+    reservations = [
+        reservation
+        for reservation in hydrate_reservations(cursor, cursor.fetchall())
+        if reservation["item"] is not None
+    ]
+    calendar = str(create_calendar_for_reservations(reservations)).encode()
+
+    return {
+        "calendar": calendar,
+        "etag": hashlib.sha256(calendar).hexdigest(),
+        "items": {reservation["item"]["item"] for reservation in reservations},
+    }
+
+
+@reservation_blueprint.route("/calendar/<token>.ics", methods=["GET"])
+def get_calendar_feed(token):
+    """
+    Returns an ICS feed of a user's active reservations that calendar apps can
+    subscribe to. Since calendar apps can't log in, the feed is accessed with
+    the token in its URL (see create_calendar_token in routes/users.py).
 
-        try:
-            os.remove(ics_path)
-        except OSError as e:
-            current_app.logger.error(e.message)
+    Rendered feeds are cached (see util/cache.py), so calendar apps polling
+    for changes don't cause any queries until the user's reservations change.
+    """
+    token_hash = hash_feed_token(token)
+    user_id = CalendarCache.get_user(token_hash, lambda: find_calendar_user(token_hash))
+
+    if user_id is None:
+        return create_error_response("Calendar not found", 404)
+
+    feed = CalendarCache.get_or_load(user_id, lambda: render_calendar_feed(user_id))
+
+    if feed is None:
+        return create_error_response("An unexpected error occurred", 500)
 
-    # END ICS
+    response = current_app.response_class(feed["calendar"], mimetype="text/calendar")
+    response.set_etag(feed["etag"])
+    response.cache_control.no_cache = True
 
-    return jsonify(updated_reservations[0])
+    return response.make_conditional(request)
@@ -1,8 +1,9 @@
-from smtplib import SMTPException
 from flask import Blueprint, jsonify, request, current_app
+from util.config import secrets
 from util.database import Database
 from util.response import create_error_response
 from util.request import require_roles
+from util.versioning import ResourceVersions
 from flask_jwt_extended import (
     jwt_required,
     get_jwt_identity,
@@ -12,6 +13,7 @@ from flask_jwt_extended import (
     unset_jwt_cookies,
 )
 from util.email import Emailer
+from util.ics import create_feed_token
 import re
 import mysql.connector
 import uuid
@@ -100,25 +102,16 @@ def register(**kwargs):
         )
 
         cursor.execute(query, data)
-        connection.commit()
-
-        # execute for the user to get their ID to pass along with the link
-        cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
-        user = cursor.fetchone()
-
-        if not user:
-            return create_error_response("An unexpected error occurred", 500)
 
+        # The verification email is queued in the same transaction so it's
+        # only sent if the account is created
         body = create_verification_email_body(
-            user_id=user["ID"],
-            name=user["fullName"],
+            user_id=cursor.lastrowid,
+            name=full_name,
             verification_code=verification_code,
         )
-
-        try:
-            Emailer.send_email(email, "Verify Your Account", body)
-        except SMTPException as err:
-            current_app.logger.exception(str(err))
+        Emailer.queue_email(cursor, email, "Verify Your Account", body)
+        connection.commit()
 
         return jsonify({"status": "New account created"})
 
@@ -170,6 +163,7 @@ def update_verification(**kwargs):
             ),
         )
         connection.commit()
+        ResourceVersions.bump("users")
 
         return jsonify({"status": "Success"})
     except Exception as err:
@@ -293,6 +287,7 @@ def delete_user(user_id, **kwargs):
         cursor.execute(query, (user_id,))
 
         connection.commit()
+        ResourceVersions.bump("users")
 
         return jsonify({"status": "Success"})
     except Exception as err:
@@ -378,6 +373,7 @@ def update_user_role(user_id, **kwargs):
     try:
         cursor.execute(query, (user_role, user_id))
         connection.commit()
+        ResourceVersions.bump("users")
     except mysql.connection.Error as err:
         current_app.logger.exception(str(err))
         return create_error_response("An unexpected error occurred", 500)
@@ -432,28 +428,24 @@ def send_update_email(user_id, **kwargs):
             (verification_code, user_id),
         )
 
+        first_name = user["fullName"].split(" ")[0]
+        body = textwrap.dedent(
+            f"""
+            Hello {first_name}, please visit the following link to change your email.
+            If you didn't request an update, you can ignore this email.
+
+            {get_base_url()}/#/update-email/{user["ID"]}/{verification_code}
+            """
+        )
+
+        Emailer.queue_email(cursor, email, "Requested Email Change", body)
         connection.commit()
 
-    except mysql.connection.Error as err:
+    except mysql.connector.Error as err:
         connection.rollback()
         current_app.logger.exception(str(err))
         return create_error_response("An unexpected error occurred", 500)
 
-    first_name = user["fullName"].split(" ")[0]
-    body = textwrap.dedent(
-        f"""
-        Hello {first_name}, please visit the following link to change your email.
-        If you didn't request an update, you can ignore this email.
-
-        {get_base_url()}/#/update-email/{user["ID"]}/{verification_code}
-        """
-    )
-
-    try:
-        Emailer.send_email(email, "Requested Email Change", body)
-    except SMTPException as e:
-        current_app.logger.error(e.message)
-
     return jsonify({"status": "Success"})
 
 
@@ -490,6 +482,14 @@ def resend_verification_email(**kwargs):
             "UPDATE users SET verificationCode = %s WHERE ID = %s",
             (verification_code, user["ID"]),
         )
+
+        body = create_verification_email_body(
+            user_id=user["ID"],
+            name=user["fullName"],
+            verification_code=verification_code,
+        )
+
+        Emailer.queue_email(cursor, email, "Verify Your Account", body)
         connection.commit()
 
     except mysql.connector.errors.Error as err:
@@ -497,18 +497,6 @@ def resend_verification_email(**kwargs):
         current_app.logger.error(str(err))
         return create_error_response("An unexpected error occurred", 500)
 
-    body = create_verification_email_body(
-        user_id=user["ID"],
-        name=user["fullName"],
-        verification_code=verification_code,
-    )
-
-    try:
-        Emailer.send_email(email, "Verify Your Account", body)
-    except SMTPException as err:
-        current_app.logger.exception(str(err))
-        return create_error_response("An unexpected error occurred", 500)
-
     return jsonify({"status": "Success"})
 
 
@@ -541,26 +529,23 @@ def send_password_reset_email(**kwargs):
             "UPDATE users SET verificationCode = %s WHERE ID = %s",
             (verification_code, user["ID"]),
         )
-        connection.commit()
 
-    except mysql.connector.errors.Error as err:
-        current_app.logger.error(str(err))
-        return create_error_response("An unexpected error occurred", 500)
+        first_name = user["fullName"].split(" ")[0]
 
-    first_name = user["fullName"].split(" ")[0]
+        body = textwrap.dedent(
+            f"""
+            Hello {first_name}, please visit the following link to reset your password.
+            If you didn't request to change your password, you can ignore this email.
 
-    body = textwrap.dedent(
-        f"""
-        Hello {first_name}, please visit the following link to reset your password.
-        If you didn't request to change your password, you can ignore this email.
+            {get_base_url()}/#/reset-password/{user["ID"]}/{verification_code}
+            """
+        )
 
-        {get_base_url()}/#/reset-password/{user["ID"]}/{verification_code}
-        """
-    )
+        Emailer.queue_email(cursor, email, "Requested Password Reset", body)
+        connection.commit()
 
-    try:
-        Emailer.send_email(email, "Requested Password Reset", body)
-    except SMTPException as err:
+    except mysql.connector.errors.Error as err:
+        connection.rollback()
         current_app.logger.error(str(err))
         return create_error_response("An unexpected error occurred", 500)
 
@@ -647,6 +632,7 @@ def update_user_email(**kwargs):
         )
 
         connection.commit()
+        ResourceVersions.bump("users")
 
     except mysql.connector.errors.IntegrityError:
         return create_error_response("This email is in use", 409)
@@ -692,6 +678,80 @@ def update_name(user_id, **kwargs):
             (full_name.strip(), user_id),
         )
         connection.commit()
+        ResourceVersions.bump("users")
+    except mysql.connector.errors.Error as err:
+        current_app.logger.error(str(err))
+        connection.rollback()
+        return create_error_response("An unexpected error occurred", 500)
+
+    return jsonify({"status": "Success"})
+
+
+def create_calendar_feed_urls(token: str) -> dict:
+    url = f"{secrets['BASE_URL']}/api/reservations/calendar/{token}.ics"
+
+    # Calendar apps recognize webcal:// links as feeds they can subscribe to
+    return {"url": url, "webcalURL": "webcal://" + url.split("://", 1)[-1]}
+
+
+@users_blueprint.route("/<int:user_id>/calendarToken", methods=["POST"])
+@jwt_required()
+@Database.with_connection()
+def create_calendar_token(user_id, **kwargs):
+    """
+    Creates the token that gives access to a user's calendar feed (see
+    get_calendar_feed in routes/reservation.py), replacing the user's previous
+    token if they had one. The token can't be retrieved again after this.
+    """
+    cursor = kwargs["cursor"]
+    connection = kwargs["connection"]
+    jwt_user = get_jwt_identity()
+
+    if jwt_user["role"].lower() == "user" and jwt_user["ID"] != user_id:
+        return create_error_response(
+            "You don't have permission to view this resource", 403
+        )
+
+    token, token_hash = create_feed_token()
+
+    try:
+        cursor.execute(
+            "UPDATE users SET calendarToken = %s WHERE ID = %s", (token_hash, user_id)
+        )
+
+        if cursor.rowcount == 0:
+            return create_error_response("User not found", 404)
+
+        connection.commit()
+        # Replaced tokens are cached until the users version changes
+        ResourceVersions.bump("users")
+    except mysql.connector.errors.Error as err:
+        current_app.logger.error(str(err))
+        connection.rollback()
+        return create_error_response("An unexpected error occurred", 500)
+
+    return jsonify({"token": token, **create_calendar_feed_urls(token)})
+
+
+@users_blueprint.route("/<int:user_id>/calendarToken", methods=["DELETE"])
+@jwt_required()
+@Database.with_connection()
+def revoke_calendar_token(user_id, **kwargs):
+    cursor = kwargs["cursor"]
+    connection = kwargs["connection"]
+    jwt_user = get_jwt_identity()
+
+    if jwt_user["role"].lower() == "user" and jwt_user["ID"] != user_id:
+        return create_error_response(
+            "You don't have permission to view this resource", 403
+        )
+
+    try:
+        cursor.execute(
+            "UPDATE users SET calendarToken = NULL WHERE ID = %s", (user_id,)
+        )
+        connection.commit()
+        ResourceVersions.bump("users")
     except mysql.connector.errors.Error as err:
         current_app.logger.error(str(err))
         connection.rollback()
@@ -0,0 +1,259 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+from util.config import secrets
+from util.versioning import ItemChanges, ResourceVersions, UserReservationChanges
+
+_entries = OrderedDict()
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+    "barcodeHits": 0,
+    "barcodeMisses": 0,
+    "calendarHits": 0,
+    "calendarMisses": 0,
+    "calendarEvictions": 0,
+}
+
+# The inventory version the cached entries were loaded at
+_version = None
+
+
+class CatalogCache:
+    """
+    An in-process LRU cache of assembled item documents. Each worker has
+    its own cache, but every entry is dropped as soon as the inventory version
+    in ResourceVersions changes, so a write committed by any worker
+    invalidates the cache in all of them.
+
+    Cached values are shared between requests so they must not be modified.
+    """
+
+    @staticmethod
+    def _sync_version():
+        global _version
+
+        version = ResourceVersions.get("inventory")
+
+        if version != _version:
+            _entries.clear()
+            _version = version
+
+    @staticmethod
+    def get_or_load(key: Hashable, loader: Callable[[], Any]):
+        """
+        Returns the cached value for "key". If there isn't one, "loader" is
+        called and its result is cached, unless the result is None or the
+        inventory changed while it was loading.
+        """
+        CatalogCache._sync_version()
+
+        if key in _entries:
+            _stats["hits"] += 1
+            _entries.move_to_end(key)
+            return _entries[key]
+
+        _stats["misses"] += 1
+        version = _version
+        value = loader()
+
+        CatalogCache._sync_version()
+
+        if value is not None and version == _version:
+            _entries[key] = value
+
+            if len(_entries) > secrets["CATALOG_CACHE_SIZE"]:
+                _entries.popitem(last=False)
+                _stats["evictions"] += 1
+
+        return value
+
+    @staticmethod
+    def stats() -> dict:
+        CatalogCache._sync_version()
+        return {
+            **_stats,
+            "size": len(_entries),
+            "maxSize": secrets["CATALOG_CACHE_SIZE"],
+            "barcodes": len(_barcodes),
+            "calendars": len(_calendars),
+        }
+
+
+_barcodes = {}
+# Item IDs mapped to every barcode their document is stored under. Barcodes are
+# compared case-insensitively by the database, so more than one spelling of a
+# barcode can load the same item.
+_barcodes_by_item = {}
+
+# How far into the change log the barcode index has read
+_change_position = ItemChanges.position()
+
+
+class BarcodeIndex:
+    """
+    An in-process map of barcodes to main item documents used by the scanner
+    routes. Unlike CatalogCache, only the items recorded in ItemChanges are
+    dropped when something changes, so scanning one item doesn't lose every
+    other scanned item when stock is checked out elsewhere.
+
+    Cached documents are shared between requests so they must not be modified.
+    """
+
+    @staticmethod
+    def _sync_changes():
+        global _change_position
+
+        _change_position, item_ids = ItemChanges.since(_change_position)
+
+        if item_ids is None:
+            _barcodes.clear()
+            _barcodes_by_item.clear()
+            return
+
+        for item_id in item_ids:
+            for barcode in _barcodes_by_item.pop(item_id, ()):
+                _barcodes.pop(barcode, None)
+
+    @staticmethod
+    def get_or_load(barcode: str, loader: Callable[[], Any]):
+        """
+        Returns the document of the main item with this barcode. If it isn't
+        in the index, "loader" is called to load it from the database. Only
+        items are stored, so empty results (barcodes that don't belong to any
+        item) and None (errors) are returned without being stored.
+        """
+        BarcodeIndex._sync_changes()
+
+        if barcode in _barcodes:
+            _stats["barcodeHits"] += 1
+            return _barcodes[barcode]
+
+        _stats["barcodeMisses"] += 1
+        position = _change_position
+        item = loader()
+
+        BarcodeIndex._sync_changes()
+
+        # If any item changed while this one was loading, it could have been
+        # this one, so it's safer not to store it
+        if item and position == _change_position:
+            _barcodes[barcode] = item
+            _barcodes_by_item.setdefault(item["item"], set()).add(barcode)
+
+        return item
+
+
+# Hashed calendar feed tokens mapped to the ID of the user they belong to
+_calendar_tokens = {}
+_calendar_users_version = ResourceVersions.get("users")
+
+# User IDs mapped to their rendered calendar feed, least recently used first
+_calendars = OrderedDict()
+# Item IDs mapped to the IDs of the users whose feeds include them
+_calendar_users_by_item = {}
+_calendar_reservation_position = UserReservationChanges.position()
+_calendar_item_position = ItemChanges.position()
+
+
+class CalendarCache:
+    """
+    An in-process cache of the calendar feeds that users subscribe to (see
+    get_calendar_feed in routes/reservation.py) and the tokens that give access
+    to them. Like BarcodeIndex, only the feeds of the users recorded in
+    UserReservationChanges, and of the users with reservations for the items
+    recorded in ItemChanges, are dropped. Tokens are dropped whenever the users
+    version changes so a revoked token stops working right away.
+
+    Cached feeds are shared between requests so they must not be modified.
+    """
+
+    @staticmethod
+    def _sync_changes():
+        global _calendar_users_version
+        global _calendar_reservation_position
+        global _calendar_item_position
+
+        version = ResourceVersions.get("users")
+
+        if version != _calendar_users_version:
+            _calendar_tokens.clear()
+            _calendar_users_version = version
+
+        _calendar_reservation_position, user_ids = UserReservationChanges.since(
+            _calendar_reservation_position
+        )
+        _calendar_item_position, item_ids = ItemChanges.since(_calendar_item_position)
+
+        if user_ids is None or item_ids is None:
+            _calendars.clear()
+            _calendar_users_by_item.clear()
+            return
+
+        for item_id in item_ids:
+            user_ids.extend(_calendar_users_by_item.pop(item_id, ()))
+
+        for user_id in user_ids:
+            _calendars.pop(user_id, None)
+
+    @staticmethod
+    def get_user(token_hash: str, loader: Callable[[], Optional[int]]):
+        """
+        Returns the ID of the user a hashed feed token belongs to. If it isn't
+        cached, "loader" is called to look it up. Tokens that don't belong to
+        any user aren't stored.
+        """
+        CalendarCache._sync_changes()
+
+        if token_hash in _calendar_tokens:
+            return _calendar_tokens[token_hash]
+
+        version = _calendar_users_version
+        user_id = loader()
+
+        CalendarCache._sync_changes()
+
+        if user_id is not None and version == _calendar_users_version:
+            _calendar_tokens[token_hash] = user_id
+
+        return user_id
+
+    @staticmethod
+    def get_or_load(user_id: int, loader: Callable[[], dict]) -> dict:
+        """
+        Returns the feed of a user. If it isn't cached, "loader" is called to
+        render it, and its result is cached unless it's None. The feed should be
+        a dict with the ID of every item in it under "items".
+        """
+        CalendarCache._sync_changes()
+
+        if user_id in _calendars:
+            _stats["calendarHits"] += 1
+            _calendars.move_to_end(user_id)
+            return _calendars[user_id]
+
+        _stats["calendarMisses"] += 1
+        positions = (_calendar_reservation_position, _calendar_item_position)
+        feed = loader()
+
+        CalendarCache._sync_changes()
+
+        # Like BarcodeIndex, the feed isn't stored if anything it could
+        # depend on might have changed while it was rendering
+        if feed is not None and positions == (
+            _calendar_reservation_position,
+            _calendar_item_position,
+        ):
+            _calendars[user_id] = feed
+
+            for item_id in feed["items"]:
+                _calendar_users_by_item.setdefault(item_id, set()).add(user_id)
+
+            if len(_calendars) > secrets["CALENDAR_CACHE_SIZE"]:
+                evicted_id, evicted = _calendars.popitem(last=False)
+                _stats["calendarEvictions"] += 1
+
+                for item_id in evicted["items"]:
+                    _calendar_users_by_item.get(item_id, set()).discard(evicted_id)
+
+        return feed
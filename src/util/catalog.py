@@ -0,0 +1,233 @@
+import base64
+import itertools
+import json
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+# These columns are stored as bits in the database so they need
+# to be converted to booleans before they're sent in a response
+ITEM_BOOLEAN_FIELDS = ("available", "moveable", "main")
+
+# The sizes of each image that can be requested (see util/imaging.py)
+IMAGE_SIZES = ("thumbnail", "card", "full")
+
+
+# The columns of itemImage mapped to the aliases they're selected with when
+# they're joined to itemChild rows (see iter_item_documents). Every column of
+# itemImage other than itemChild needs to be listed here so images built from
+# joined rows are the same as ones selected from itemImage directly.
+IMAGE_COLUMN_ALIASES = {
+    "ID": "imageID",
+    "imagePath": "imagePath",
+    "imageURL": "imageURL",
+    "thumbnailPath": "imageThumbnailPath",
+    "thumbnailURL": "imageThumbnailURL",
+    "cardPath": "imageCardPath",
+    "cardURL": "imageCardURL",
+    "status": "imageStatus",
+    "uploaded": "imageUploaded",
+    "contentHash": "imageContentHash",
+}
+
+# Selects itemChild rows along with the columns of the item they belong to.
+# Callers are expected to append their own WHERE/ORDER BY clauses.
+ITEM_SELECT_QUERY = """
+    SELECT
+        A.*, B.barcode, B.available, B.moveable, B.location, B.quantity,
+        B.retiredDateTime
+    FROM itemChild AS A
+    LEFT JOIN item AS B on A.item = B.ID
+"""
+
+
+def create_placeholders(values) -> str:
+    """
+    Returns a comma separated list of "%s" placeholders, one for each value,
+    that can be used in an "IN (...)" clause.
+    """
+    return ", ".join(["%s"] * len(values))
+
+
+def chunked(values: list, size: int):
+    """
+    Splits a list into chunks of at most "size" values. Yields the index of
+    the first value in each chunk along with the chunk.
+    """
+    for start in range(0, len(values), size):
+        end = start + size
+        yield start, values[start:end]
+
+
+def group_by(rows: Iterable[dict], key: str) -> Dict[Any, List[dict]]:
+    """
+    Groups a list of rows by the value of "key" in a single pass. The
+    order of rows within each group is the same as the order in "rows".
+    """
+    groups = defaultdict(list)
+
+    for row in rows:
+        groups[row[key]].append(row)
+
+    return groups
+
+
+def normalize_item(row: dict) -> dict:
+    """
+    Converts the bit columns of an item row to booleans in place
+    and returns the same row.
+    """
+    for field in ITEM_BOOLEAN_FIELDS:
+        row[field] = bool(row[field])
+
+    return row
+
+
+def build_item_documents(item_rows: Iterable[dict], images: Iterable[dict]):
+    """
+    Takes rows from the item/itemChild join and rows from the itemImage table
+    and returns a list of main items. Each item gets an "images" list and each
+    main item gets a "children" list containing its child items.
+
+    Images and children are indexed up front so this runs in linear time
+    regardless of how many items or images there are.
+    """
+    images_by_child = group_by(images, "itemChild")
+    main_items = []
+    child_items = []
+
+    for row in item_rows:
+        row["images"] = images_by_child.get(row["ID"], [])
+        normalize_item(row)
+
+        if row["main"]:
+            main_items.append(row)
+        else:
+            child_items.append(row)
+
+    children_by_item = group_by(child_items, "item")
+
+    for row in main_items:
+        row["children"] = children_by_item.get(row["item"], [])
+
+    return main_items
+
+
+def select_image_size(items: List[dict], size: str) -> List[dict]:
+    """
+    Returns copies of the given item documents where the imageURL of every image
+    (including the images of children) points at the given size of that image.
+    Images that don't have that size yet (while they're still processing) keep
+    the URL of the full image. The documents passed in aren't modified since
+    they're usually cached.
+    """
+    if size == "full":
+        return items
+
+    def with_size(document: dict) -> dict:
+        document = dict(document)
+        document["images"] = [
+            {**image, "imageURL": image.get(f"{size}URL") or image["imageURL"]}
+            for image in document["images"]
+        ]
+
+        if "children" in document:
+            document["children"] = [with_size(child) for child in document["children"]]
+
+        return document
+
+    return [with_size(item) for item in items]
+
+
+def load_item_documents(cursor, main_rows: List[dict]):
+    """
+    Takes a list of main item rows (selected with ITEM_SELECT_QUERY) and loads
+    their children and every image in two batched queries, regardless of how
+    many items there are. Returns the main items in the same order.
+    """
+    if not main_rows:
+        return []
+
+    item_ids = list({row["item"] for row in main_rows})
+    cursor.execute(
+        ITEM_SELECT_QUERY
+        + f"WHERE A.main = 0 AND A.item IN ({create_placeholders(item_ids)})",
+        item_ids,
+    )
+    rows = main_rows + cursor.fetchall()
+
+    child_ids = [row["ID"] for row in rows]
+    cursor.execute(
+        f"SELECT * FROM itemImage WHERE itemChild IN ({create_placeholders(child_ids)})",
+        child_ids,
+    )
+
+    return build_item_documents(rows, cursor.fetchall())
+
+
+def iter_item_documents(rows: Iterable[dict]):
+    """
+    Lazily builds main item documents from rows of itemChild joined with item
+    and itemImage, where every image column is aliased as it is in
+    IMAGE_COLUMN_ALIASES. Rows must be ordered by item and then by itemChild ID
+    so that only one item and its children need to be held in memory at a time.
+    """
+    for _, group in itertools.groupby(rows, key=lambda row: row["item"]):
+        main_item = None
+        children = []
+        documents = {}
+
+        for row in group:
+            image = {
+                column: row.pop(alias) for column, alias in IMAGE_COLUMN_ALIASES.items()
+            }
+            image["itemChild"] = row["ID"]
+            document = documents.get(row["ID"])
+
+            if document is None:
+                document = normalize_item(row)
+                document["images"] = []
+                documents[row["ID"]] = document
+
+                if document["main"]:
+                    main_item = document
+                else:
+                    children.append(document)
+
+            # The image columns are null for rows without any images
+            if image["ID"] is not None:
+                document["images"].append(image)
+
+        # Children without a main item aren't included in the catalog
+        if main_item is not None:
+            main_item["children"] = children
+            yield main_item
+
+
+def encode_page_cursor(last_id: int) -> str:
+    """
+    Creates the opaque cursor that's handed to clients so they can request
+    the page that starts after the itemChild with the ID "last_id".
+    """
+    payload = json.dumps({"id": last_id}).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii")
+
+
+def decode_page_cursor(page_cursor: Optional[str]) -> int:
+    """
+    Returns the itemChild ID stored in a cursor created by encode_page_cursor.
+    An empty cursor refers to the first page. Raises ValueError if the cursor
+    is malformed.
+    """
+    if not page_cursor:
+        return 0
+
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(page_cursor.encode("ascii")))
+        last_id = payload["id"]
+    except Exception as err:
+        raise ValueError("Invalid cursor") from err
+
+    if not isinstance(last_id, int) or last_id < 0:
+        raise ValueError("Invalid cursor")
+
+    return last_id
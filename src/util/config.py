@@ -20,6 +20,34 @@ secrets = {
         os.getenv("SCHEDULER_ENABLED", default="true").lower() == "true"
     ),
     "BASE_URL": os.getenv("BASE_URL", default="http://127.0.0.1/4565"),
+    "CATALOG_CACHE_SIZE": int(os.getenv("CATALOG_CACHE_SIZE", default="1024")),
+    # The most users whose calendar feeds are cached by each worker
+    "CALENDAR_CACHE_SIZE": int(os.getenv("CALENDAR_CACHE_SIZE", default="1024")),
+    # The largest image (in bytes) that can be uploaded
+    "MAX_IMAGE_UPLOAD_SIZE": int(
+        os.getenv("MAX_IMAGE_UPLOAD_SIZE", default="20000000")
+    ),
+    # When the server is behind nginx, setting this to the path of an internal
+    # location that serves the image folder lets nginx send images directly
+    "IMAGE_ACCEL_REDIRECT": os.getenv("IMAGE_ACCEL_REDIRECT", default=""),
+    "IMAGE_PROCESSING_WORKERS": int(os.getenv("IMAGE_PROCESSING_WORKERS", default="2")),
+    # Uploaded images are only processed when this is enabled (see
+    # background_tasks/images.py), so only turn it off if another
+    # server processes them
+    "IMAGE_PROCESSING_ENABLED": (
+        os.getenv("IMAGE_PROCESSING_ENABLED", default="true").lower() == "true"
+    ),
+    # Queued emails are only sent when this is enabled (see
+    # background_tasks/outbox.py), so only turn it off if another
+    # server sends them
+    "EMAIL_OUTBOX_ENABLED": (
+        os.getenv("EMAIL_OUTBOX_ENABLED", default="true").lower() == "true"
+    ),
+    # The most catalog streams (see stream_all in routes/inventory.py) each
+    # worker serves at once. Each one holds its own database connection.
+    "MAX_STREAMS": int(os.getenv("MAX_STREAMS", default="4")),
+    # The most connections to the email server that are kept open at once
+    "EMAIL_CONNECTIONS": int(os.getenv("EMAIL_CONNECTIONS", default="2")),
 }
 
 
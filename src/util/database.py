@@ -1,21 +1,63 @@
 import mysql.connector
 import mysql.connector.pooling
 import functools
+import threading
+from typing import Iterator, Optional
 from util.config import secrets
 from flask import current_app
 
+_connection_settings = {
+    # Timeout is given in seconds
+    "connection_timeout": 30,
+    "host": secrets["DB_HOST"],
+    "user": secrets["DB_USERNAME"],
+    "password": secrets["DB_PASSWORD"],
+    "database": secrets["DB_DATABASE"],
+}
 
 _connection_pool = mysql.connector.pooling.MySQLConnectionPool(
-    pool_name="database_pool",
-    pool_size=5,
-    # Timeout is given in seconds
-    connection_timeout=30,
-    host=secrets["DB_HOST"],
-    user=secrets["DB_USERNAME"],
-    password=secrets["DB_PASSWORD"],
-    database=secrets["DB_DATABASE"],
+    pool_name="database_pool", pool_size=5, **_connection_settings
 )
 
+# Streams are read on their own connections (see Database.stream_rows), so
+# this caps how many of those each worker opens
+_stream_slots = threading.BoundedSemaphore(secrets["MAX_STREAMS"])
+
+
+class RowStream:
+    """
+    The rows of a query that are read from the server as they're iterated over.
+    close needs to be called once the rows are no longer needed, even if they
+    were never iterated over, since it closes the connection.
+    """
+
+    def __init__(self, connection, cursor, batch_size: int):
+        self._connection = connection
+        self._cursor = cursor
+        self._batch_size = batch_size
+
+    def __iter__(self) -> Iterator[dict]:
+        while True:
+            rows = self._cursor.fetchmany(self._batch_size)
+
+            if not rows:
+                break
+
+            yield from rows
+
+    def close(self):
+        if self._connection is None:
+            return
+
+        try:
+            # The connection isn't reused, so any rows that are left (for
+            # instance, because the client disconnected) don't need to be read
+            # before it's closed. Closing the cursor would try to read them.
+            self._connection.close()
+        finally:
+            self._connection = None
+            _stream_slots.release()
+
 
 class Database:
     """
@@ -48,3 +90,34 @@ class Database:
             return wrapper
 
         return decorator
+
+    @staticmethod
+    def stream_rows(
+        query: str, variables: Optional[dict] = None, batch_size=500
+    ) -> Optional[RowStream]:
+        """
+        Runs "query" on an unbuffered cursor and returns its rows as dicts,
+        fetching "batch_size" rows from the server at a time. The connection is
+        held until the stream is closed, so this can be used to back a streamed
+        response. Since a slow client can hold it for a long time, it's opened
+        outside the connection pool so requests that use with_connection aren't
+        left without one. Returns None if MAX_STREAMS streams are already open.
+        Throws mysql.connector.Error if the query fails.
+        """
+        if not _stream_slots.acquire(blocking=False):
+            return None
+
+        connection = None
+
+        try:
+            connection = mysql.connector.connect(**_connection_settings)
+            cursor = connection.cursor(dictionary=True, buffered=False)
+            cursor.execute(query, variables)
+        except BaseException:
+            if connection is not None:
+                connection.close()
+
+            _stream_slots.release()
+            raise
+
+        return RowStream(connection, cursor, batch_size)
@@ -1,39 +1,235 @@
-from typing import Optional
-from flask_mail import Mail, Message
+import os
+import smtplib
+import threading
+import time
+from typing import Iterable, Iterator, List, Optional, Tuple
+from flask_mail import Connection, Mail, Message
 from util.config import secrets
 
+# Connections that have been idle for this many seconds are checked with a NOOP
+# before they're reused. Ones that have been idle for longer than MAX_IDLE are
+# closed instead since most servers drop sessions after 5 idle minutes.
+HEALTH_CHECK_AFTER = 10
+MAX_IDLE = 4 * 60
+
+
+def close_connection(connection: Connection):
+    if connection.host is None:
+        return
+
+    try:
+        connection.host.quit()
+    except (smtplib.SMTPException, OSError):
+        # The server may have already closed the session
+        connection.host.close()
+
+
+def is_alive(connection: Connection) -> bool:
+    if connection.host is None:
+        return True
+
+    try:
+        return connection.host.noop()[0] == 250
+    except (smtplib.SMTPException, OSError):
+        return False
+
+
+class SMTPConnectionPool:
+    """
+    Keeps up to "size" connections to the mail server open so emails sent one
+    after another share a session instead of each one connecting, starting TLS
+    and logging in again. Connections are opened the first time they're needed.
+    """
+
+    def __init__(self, size: int):
+        self._size = size
+        self._reset()
+
+        # Sessions can't be shared between processes, so processes forked from
+        # this one (like gunicorn's workers) start with an empty pool
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._slots = threading.BoundedSemaphore(self._size)
+        self._lock = threading.Lock()
+        # Pairs of (connection, when it was last used), most recently used last
+        self._idle: List[Tuple[Connection, float]] = []
+
+    def get(self, mail: Mail) -> Connection:
+        """
+        Returns an open connection, waiting for one to be returned if all of them
+        are in use. Throws SMTPException or OSError if a new connection couldn't
+        be opened.
+        """
+        self._slots.acquire()
+
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+
+                    connection, last_used = self._idle.pop()
+
+                idle = time.monotonic() - last_used
+
+                if idle < HEALTH_CHECK_AFTER or (
+                    idle < MAX_IDLE and is_alive(connection)
+                ):
+                    return connection
+
+                close_connection(connection)
+
+            return mail.connect().__enter__()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def put(self, connection: Connection):
+        with self._lock:
+            self._idle.append((connection, time.monotonic()))
+
+        self._slots.release()
+
+    def discard(self, connection: Connection):
+        """
+        Closes a connection that's no longer usable instead of returning it
+        """
+        close_connection(connection)
+        self._slots.release()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for connection, _ in idle:
+            close_connection(connection)
+
 
 class Emailer:
     _mail = Mail()
+    _pool = SMTPConnectionPool(secrets["EMAIL_CONNECTIONS"])
 
     @staticmethod
     def init(app):
         Emailer._mail.init_app(app)
 
     @staticmethod
-    def send_email(
+    def create_message(
         recipient: str,
         subject: str,
         body: str,
-        attachment: Optional[str] = None,
+        attachment: Optional[bytes] = None,
         cc: Optional[str] = None,
-    ):
-        """
-        Sends an email to the specified recipient.
-        Throws SMTPException on failure
-        """
+        attachment_name: Optional[str] = None,
+    ) -> Message:
         message = Message(
             recipients=[recipient],
             subject=subject,
             body=body,
             sender=secrets["EMAIL_USERNAME"],
-            cc=[cc],
+            cc=[cc] if cc else None,
         )
 
         # Can only add a single attachment
-        # Attachment is formatted as a string representing the filepath
-        if attachment:
-            with open(attachment) as fp:
-                message.attach(attachment, "calendar/ics", fp.read())
+        if attachment is not None:
+            message.attach(attachment_name, "text/calendar", attachment)
 
-        Emailer._mail.send(message)
+        return message
+
+    @staticmethod
+    def send_email(
+        recipient: str,
+        subject: str,
+        body: str,
+        attachment: Optional[bytes] = None,
+        cc: Optional[str] = None,
+        attachment_name: Optional[str] = None,
+    ):
+        """
+        Sends an email to the specified recipient.
+        Throws SMTPException on failure
+        """
+        message = Emailer.create_message(
+            recipient, subject, body, attachment, cc, attachment_name
+        )
+
+        # The results are collected first so the connection is returned to
+        # the pool before an error is raised
+        for _, error in list(Emailer.send_messages([message])):
+            if error is not None:
+                raise error
+
+    @staticmethod
+    def send_messages(
+        messages: Iterable[Message],
+    ) -> Iterator[Tuple[Message, Optional[Exception]]]:
+        """
+        Sends every message (see create_message) over a single pooled connection,
+        yielding each message along with the error it couldn't be sent because of
+        (or None if it was sent) as soon as it's been sent. A message that fails
+        because the server closed the connection is retried on a new connection.
+
+        Throws SMTPException or OSError if the server can't be connected to,
+        in which case none of the remaining messages are sent.
+        """
+        connection = None
+
+        try:
+            for message in messages:
+                error = None
+
+                for _ in range(2):
+                    if connection is None:
+                        connection = Emailer._pool.get(Emailer._mail)
+
+                    try:
+                        connection.send(message)
+                        error = None
+                        break
+                    except smtplib.SMTPServerDisconnected as err:
+                        Emailer._pool.discard(connection)
+                        connection = None
+                        error = err
+                    except smtplib.SMTPException as err:
+                        # The server refused this message, but the
+                        # connection can still be used for the next one
+                        error = err
+                        break
+                    except OSError as err:
+                        Emailer._pool.discard(connection)
+                        connection = None
+                        error = err
+                        break
+
+                yield message, error
+        finally:
+            if connection is not None:
+                Emailer._pool.put(connection)
+
+    @staticmethod
+    def queue_email(
+        cursor,
+        recipient: str,
+        subject: str,
+        body: str,
+        attachment: Optional[bytes] = None,
+        cc: Optional[str] = None,
+        attachment_name: Optional[str] = None,
+    ):
+        """
+        Adds an email to the outbox so it's sent in the background (see
+        background_tasks/outbox.py) instead of during the request. This doesn't
+        commit, so the email is only sent if the caller commits the transaction
+        it was queued in.
+        """
+        cursor.execute(
+            """
+            INSERT INTO emailOutbox (
+                recipient, cc, subject, body, attachmentName, attachment
+            )
+            VALUES (%s, %s, %s, %s, %s, %s)
+            """,
+            (recipient, cc, subject, body, attachment_name, attachment),
+        )
@@ -1,40 +1,75 @@
-from util.database import Database
+import hashlib
+import secrets
+from typing import List, Tuple
 from ics import Calendar, Event
 from dateutil import tz
 
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
-@Database.with_connection()
-def create_calendar_for_reservation(reservation, **kwargs):
+
+def create_event_for_reservation(reservation) -> Event:
+    start = reservation["startDateTime"].replace(tzinfo=tz.gettz())
+    end = reservation["endDateTime"].replace(tzinfo=tz.gettz())
+
+    start = start.astimezone(tz.tzutc())
+    end = end.astimezone(tz.tzutc())
+
+    event = Event()
+
+    # The UID is what lets calendar apps subscribed to a feed update an
+    # event when a reservation changes instead of adding a duplicate
+    event.uid = f"chdr-reservation-{reservation['ID']}"
+    event.name = "CHDR Reservation"
+    event.begin = start.strftime(DATE_FORMAT)
+    event.end = end.strftime(DATE_FORMAT)
+    event.description = f"UCF CHDR Reservation: {reservation['item']['name']}"
+
+    return event
+
+
+def create_calendar_for_reservation(reservation) -> Calendar:
     """
     Takes details from a given reservation and returns a
     Calendar object containing the reservation details.
+    The reservation should include its item (see hydrate_reservations
+    in routes/reservation.py) so that nothing has to be queried.
     """
+    return create_calendar_for_reservations([reservation])
 
-    cursor = kwargs["cursor"]
-    date_format = "%Y-%m-%d %H:%M:%S"
-    iid = reservation["item"]["item"]
-    start = reservation["startDateTime"]
-    end = reservation["endDateTime"]
 
-    start = start.replace(tzinfo=tz.gettz())
-    end = end.replace(tzinfo=tz.gettz())
+def create_calendar_for_reservations(reservations: List[dict]) -> Calendar:
+    """
+    Like create_calendar_for_reservation, but with an event for every
+    reservation in "reservations"
+    """
+    calendar = Calendar()
 
-    start = start.astimezone(tz.tzutc())
-    end = end.astimezone(tz.tzutc())
+    for reservation in reservations:
+        calendar.events.add(create_event_for_reservation(reservation))
 
-    query = f"SELECT name FROM itemChild WHERE item = {iid} AND main = 1"
-    cursor.execute(query)
-    itemName = cursor.fetchone()
-    itemName = itemName["name"]
+    return calendar
 
-    event = Event()
-    calendar = Calendar()
 
-    event.name = "CHDR Reservation"
-    event.begin = start.strftime(date_format)
-    event.end = end.strftime(date_format)
-    event.description = f"UCF CHDR Reservation: {itemName}"
+def create_ics_attachment(reservation) -> bytes:
+    """
+    Returns the contents of an .ics file for the reservation, built in memory
+    so it can be attached to an email without being written to disk
+    """
+    return str(create_calendar_for_reservation(reservation)).encode()
 
-    calendar.events.add(event)
 
-    return calendar
+def hash_feed_token(token: str) -> str:
+    """
+    Calendar feed tokens are only stored as their SHA-256 hash so the
+    tokens can't be read from the database
+    """
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def create_feed_token() -> Tuple[str, str]:
+    """
+    Returns a new token for a user's calendar feed along with its hash
+    """
+    token = secrets.token_urlsafe(32)
+
+    return token, hash_feed_token(token)
@@ -1,36 +1,191 @@
-from flask import current_app
+from io import BytesIO
 from PIL import Image, ImageOps
+from typing import Dict, Optional
+import hashlib
 import os.path
+import shutil
+import time
 
+# The longest side (in pixels) of a compressed image
+MAX_IMAGE_DIMENSION = 1920
 
-def compress_image(image_path: str):
+# The size compressed JPEGs should fit in. The quality is lowered until they do.
+MAX_IMAGE_BYTES = 500_000
+MIN_JPEG_QUALITY = 35
+MAX_JPEG_QUALITY = 85
+
+# Images with more pixels than this are rejected instead of being decoded. A
+# 50 megapixel RGB image takes about 150 MB to decode at full size.
+MAX_IMAGE_PIXELS = 50_000_000
+
+# The widths (in pixels) of the smaller copies made of every uploaded image.
+# The "full" variant is the compressed original (see compress_image).
+IMAGE_VARIANTS = {
+    "thumbnail": 200,
+    "card": 600,
+}
+
+
+def compress_image(image_path: str, output_path: Optional[str] = None):
     """
-    Takes a path to an image, resizes and compresses it, then saves it
-    to the same location. Note that this will replace the original image.
+    Takes a path to an image, shrinks it to fit within MAX_IMAGE_DIMENSION and
+    compresses it to fit within MAX_IMAGE_BYTES, then saves it to "output_path".
+    If no output path is given, the image is saved to the same location. Note
+    that this will replace the original image.
+
+    JPEGs are decoded at a reduced size (using draft mode) when they're much
+    larger than the target, so memory usage depends on the size of the output
+    rather than the size of the upload. Images with more than MAX_IMAGE_PIXELS
+    pixels are rejected with a DecompressionBombError before being decoded.
+
+    This is CPU bound and can take seconds for large images, so it shouldn't
+    be called while handling a request (see background_tasks/images.py).
+    Exceptions are left to the caller since this usually runs in a separate
+    process without access to the app's logger.
     """
-    try:
-        # Don't optimize the image if it's already smaller than 500 KB
-        if os.path.getsize(image_path) <= 500_000:
+    output_path = output_path or image_path
+
+    with Image.open(image_path) as image:
+        # Opening an image only reads its header, so this is checked
+        # before any memory is spent decoding it
+        if image.width * image.height > MAX_IMAGE_PIXELS:
+            raise Image.DecompressionBombError(
+                f"Image has {image.width * image.height} pixels, "
+                f"the limit is {MAX_IMAGE_PIXELS}"
+            )
+
+        image_format = image.format
+        fits = max(image.size) <= MAX_IMAGE_DIMENSION
+
+        # Don't touch images that are already small enough
+        if fits and os.path.getsize(image_path) <= MAX_IMAGE_BYTES:
+            if output_path != image_path:
+                shutil.copyfile(image_path, output_path)
+
             return
 
-        image = Image.open(image_path)
-        width, height = image.size
-        scale_factor = 0.70
-        width = int(width * scale_factor)
-        height = int(height * scale_factor)
+        scale = min(1, MAX_IMAGE_DIMENSION / max(image.size))
+        size = (round(image.width * scale), round(image.height * scale))
 
-        image = image.resize((width, height), Image.LANCZOS)
+        # Only affects JPEGs. The image is decoded at the smallest scale
+        # (1/2, 1/4 or 1/8) that's still at least as large as "size".
+        image.draft("RGB", size)
+        image.thumbnail(size, Image.LANCZOS)
 
-        # Sometimes resizing the image causes its rotation to change
-        # so we need to make sure the original orientation is kept
+        # Resizing drops the image's orientation so it's applied here,
+        # which also keeps the rotation cheap since the image is smaller
         image = ImageOps.exif_transpose(image)
 
-        image.save(
-            image_path,
-            quality=35,
-            optimize=True,
-        )
+        if image_format == "JPEG":
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+
+            data = encode_jpeg(image, MAX_IMAGE_BYTES)
+        else:
+            buffer = BytesIO()
+            image.save(buffer, format=image_format, optimize=True)
+            data = buffer.getvalue()
+
+    with open(output_path, "wb") as file:
+        file.write(data)
+
+
+def encode_jpeg(image: Image.Image, max_bytes: int) -> bytes:
+    """
+    Returns the image encoded as a JPEG at the highest quality between
+    MIN_JPEG_QUALITY and MAX_JPEG_QUALITY that fits within "max_bytes". If the
+    image doesn't fit even at the lowest quality, that's what's returned.
+    """
+    low, high = MIN_JPEG_QUALITY, MAX_JPEG_QUALITY
+    best = None
+    smallest = None
+
+    # Binary search over the quality, which only takes a few encodes
+    while low <= high:
+        quality = (low + high) // 2
+        buffer = BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+
+        if buffer.tell() <= max_bytes:
+            best = buffer.getvalue()
+            low = quality + 1
+        else:
+            smallest = buffer.getvalue()
+            high = quality - 1
+
+    return best if best is not None else smallest
+
+
+def get_variant_path(image_path: str, variant: str) -> str:
+    """
+    Returns the path a variant of an image is saved to, for example
+    "images/camera.jpg" becomes "images/camera_thumbnail.jpg"
+    """
+    root, extension = os.path.splitext(image_path)
+    return f"{root}_{variant}{extension}"
+
+
+def create_image_variants(image_path: str) -> Dict[str, str]:
+    """
+    Saves a copy of an image at each of the widths in IMAGE_VARIANTS next to
+    the original and returns the path of each copy. Images are never scaled
+    up, so images narrower than a variant are saved at their original size.
+    """
+    paths = {}
+
+    with Image.open(image_path) as original:
+        image = ImageOps.exif_transpose(original)
+
+        for variant, width in IMAGE_VARIANTS.items():
+            variant_image = image
+
+            if image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                variant_image = image.resize((width, height), Image.LANCZOS)
+
+            paths[variant] = get_variant_path(image_path, variant)
+            variant_image.save(paths[variant], quality=70, optimize=True)
+
+    return paths
+
+
+def hash_file(path: str, chunk_size=64 * 1024) -> str:
+    """
+    Returns the SHA-256 hash of a file as a hex string, reading the file
+    "chunk_size" bytes at a time
+    """
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def get_content_addressed_path(folder: str, content_hash: str, extension: str):
+    """
+    Returns the path a processed image is stored at. Since the name only depends
+    on the contents of the uploaded image, the same upload always ends up at the
+    same path and the file at that path never changes.
+    """
+    return os.path.join(folder, f"{content_hash}.{extension.lower()}")
+
+
+def process_image(image_path: str, output_path: Optional[str] = None) -> dict:
+    """
+    Compresses an image to "output_path" (or in place), creates its variants
+    and returns the path of each variant along with how many seconds it took.
+    This lives here instead of in background_tasks/images.py so that the
+    processes it runs in don't have to import the rest of the app.
+    """
+    output_path = output_path or image_path
+    start = time.perf_counter()
+    compress_image(image_path, output_path)
+    variants = create_image_variants(output_path)
 
-        image.close()
-    except Exception as err:
-        current_app.logger.exception(str(err))
+    return {
+        "imagePath": output_path,
+        "variants": variants,
+        "processingTime": time.perf_counter() - start,
+    }
@@ -1,7 +1,12 @@
 import functools
-from typing import List
+import os
+import tempfile
+from typing import List, Optional
+from flask import current_app, request
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_jwt_extended import get_jwt_identity, jwt_required
 from util.response import create_error_response
+from util.versioning import ResourceVersions
 
 
 def require_roles(roles: List[str]):
@@ -42,3 +47,144 @@ def require_roles(roles: List[str]):
         return wrapper
 
     return decorator
+
+
+def with_etag(*resources: str):
+    """
+    This decorator sets an ETag on the response of the decorated route that
+    changes whenever one of "resources" changes. If the request's If-None-Match
+    header matches the current ETag, this returns a 304 without calling the
+    decorated route so none of its queries are run.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # The ETag needs to be created before the route runs. Otherwise, a
+            # write that happens while the route is running could give the
+            # response a newer ETag than the data it contains.
+            etag = ResourceVersions.etag(*resources)
+
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+                response.set_etag(etag)
+                return response
+
+            response = current_app.make_response(func(*args, **kwargs))
+
+            if response.status_code == 200:
+                response.set_etag(etag)
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def parse_limit_parameter(default: Optional[int], max_limit: int) -> Optional[int]:
+    """
+    Returns the "limit" query parameter, or "default" if it wasn't passed.
+    Raises ValueError if it isn't a number between 1 and "max_limit". This
+    can't use request.args.get with type=int since that returns the default
+    for values that aren't numbers too.
+    """
+    value = request.args.get("limit")
+
+    if value is None:
+        return default
+
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = None
+
+    if limit is None or not 1 <= limit <= max_limit:
+        raise ValueError(f"Parameter limit must be between 1 and {max_limit}")
+
+    return limit
+
+
+class SizeLimitedStream:
+    """
+    Wraps the body of a request and raises RequestEntityTooLarge as soon as
+    more than "max_size" bytes have been read from it. Werkzeug only compares
+    MAX_CONTENT_LENGTH to the Content-Length header, so this is what limits
+    bodies sent without one (with chunked transfer encoding, for example).
+    """
+
+    def __init__(self, stream, max_size: int, chunk_size=64 * 1024):
+        self._stream = stream
+        self._max_size = max_size
+        self._chunk_size = chunk_size
+        self._size = 0
+
+    def _count(self, data: bytes) -> bytes:
+        self._size += len(data)
+
+        if self._size > self._max_size:
+            raise RequestEntityTooLarge()
+
+        return data
+
+    def read(self, size=-1) -> bytes:
+        if size is not None and size >= 0:
+            return self._count(self._stream.read(size))
+
+        chunks = []
+
+        while True:
+            chunk = self._count(self._stream.read(self._chunk_size))
+
+            if not chunk:
+                return b"".join(chunks)
+
+            chunks.append(chunk)
+
+    def readline(self, size=-1) -> bytes:
+        return self._count(self._stream.readline(size))
+
+
+def limit_request_body(max_size: int):
+    """
+    Makes reading more than "max_size" bytes of the current request's body
+    raise RequestEntityTooLarge. This has to be called before anything reads
+    the body, including request.files, request.form and request.get_json.
+    """
+    request.stream = SizeLimitedStream(request.stream, max_size)
+
+
+def save_request_body(directory: str, max_size: int, chunk_size=64 * 1024) -> str:
+    """
+    Streams the raw body of the current request into a temporary file in
+    "directory" "chunk_size" bytes at a time and returns the path of the file,
+    so memory usage stays the same no matter how large the body is. The caller
+    is responsible for moving or deleting the file.
+
+    Raises RequestEntityTooLarge (and deletes the file) if the body is larger
+    than "max_size" bytes.
+    """
+    size = 0
+    file = tempfile.NamedTemporaryFile(dir=directory, prefix="upload-", delete=False)
+
+    try:
+        with file:
+            while True:
+                chunk = request.stream.read(chunk_size)
+
+                if not chunk:
+                    break
+
+                size += len(chunk)
+
+                # The Content-Length header can't be trusted (or might not
+                # be sent at all) so the size is checked as the body is read
+                if size > max_size:
+                    raise RequestEntityTooLarge()
+
+                file.write(chunk)
+    except BaseException:
+        os.remove(file.name)
+        raise
+
+    return file.name
@@ -1,7 +1,9 @@
 from flask_apscheduler import APScheduler
 from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_MISSED
 import background_tasks.debug
+import background_tasks.images
 import background_tasks.notification
+import background_tasks.outbox
 from util.config import secrets
 
 
@@ -20,14 +22,41 @@ def init_scheduler(app):
     # flake8: noqa: E501
     # For a list a parameters you can pass to the scheduler when adding a job, see:
     # https://apscheduler.readthedocs.io/en/3.x/modules/schedulers/base.html#apscheduler.schedulers.base.BaseScheduler.add_job
-    scheduler.add_job(
-        func=lambda: background_tasks.notification.due_date_iterator(app),
-        id="tick",
-        name="tick",
-        trigger="interval",
-        hours=24,
-        max_instances=1,
-    )
+    # SCHEDULER_ENABLED only controls the nightly due date reminders. Uploaded
+    # images and queued emails are only handled by the jobs below, so turning
+    # off the reminders shouldn't leave images stuck in 'processing' or stop
+    # every email from being sent.
+    if secrets["SCHEDULER_ENABLED"]:
+        scheduler.add_job(
+            func=lambda: background_tasks.notification.due_date_iterator(app),
+            id="tick",
+            name="tick",
+            trigger="interval",
+            hours=24,
+            max_instances=1,
+        )
+
+    if secrets["IMAGE_PROCESSING_ENABLED"]:
+        scheduler.add_job(
+            func=lambda: background_tasks.images.image_iterator(app),
+            id="images",
+            name="images",
+            trigger="interval",
+            seconds=5,
+            max_instances=1,
+        )
+
+    # Every email the server sends is queued in the outbox and only sent by
+    # this job, so it's kept running when the reminders are turned off
+    if secrets["EMAIL_OUTBOX_ENABLED"]:
+        scheduler.add_job(
+            func=lambda: background_tasks.outbox.outbox_iterator(app),
+            id="emails",
+            name="emails",
+            trigger="interval",
+            seconds=5,
+            max_instances=1,
+        )
 
     """
     scheduler.add_job(
@@ -40,6 +69,6 @@ def init_scheduler(app):
     )
     """
 
-    if secrets["SCHEDULER_ENABLED"]:
+    if scheduler.get_jobs():
         app.logger.info("Scheduler initialized")
         scheduler.start()
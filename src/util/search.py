@@ -0,0 +1,233 @@
+import bisect
+import os
+import re
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set
+from util.versioning import ItemChanges
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# How much a match in each column counts towards an item's score
+FIELD_WEIGHTS = {
+    "name": 4.0,
+    "type": 2.0,
+    "serial": 2.0,
+    "vendorName": 1.5,
+    "description": 1.0,
+}
+
+# Matches on a child item count for less than matches on the main item
+CHILD_WEIGHT = 0.5
+
+# Prefix matches count for less than matching a whole word
+PREFIX_WEIGHT = 0.75
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """
+    Splits text into lowercase alphanumeric tokens
+    """
+    if not text:
+        return []
+
+    return _TOKEN_PATTERN.findall(str(text).lower())
+
+
+class SearchIndex:
+    """
+    An inverted index over the searchable columns of the itemChild table.
+    Every row is indexed under the ID of the item it belongs to, so searches
+    return IDs from the item table with the best matches first.
+    """
+
+    def __init__(self, rows: Iterable[dict]):
+        # Maps a token to the score of every item that contains it
+        self._postings: Dict[str, Dict[int, float]] = {}
+        # Maps the ID of every indexed item to the tokens it's indexed under
+        self._tokens_by_item: Dict[int, Set[str]] = {}
+
+        for row in rows:
+            self._add_row(row)
+
+        self._tokens = sorted(self._postings)
+
+    def _add_row(self, row: dict):
+        """
+        Adds a row to the postings without updating the sorted list of tokens
+        """
+        item_id = row["item"]
+        weight = 1.0 if row["main"] else CHILD_WEIGHT
+        item_tokens = self._tokens_by_item.setdefault(item_id, set())
+
+        for field, field_weight in FIELD_WEIGHTS.items():
+            tokens = tokenize(row.get(field))
+            score = weight * field_weight
+
+            # Serial numbers are usually searched for without their
+            # separators, so also index them as a single token
+            if field == "serial" and len(tokens) > 1:
+                tokens.append("".join(tokens))
+
+            for token in tokens:
+                postings = self._postings.get(token)
+                item_tokens.add(token)
+
+                if postings is None:
+                    self._postings[token] = {item_id: score}
+                elif postings.get(item_id, 0) < score:
+                    postings[item_id] = score
+
+    def update_items(self, item_ids: Iterable[int], rows: Iterable[dict]):
+        """
+        Replaces everything indexed for the items in "item_ids" with "rows",
+        which should be every itemChild row that belongs to those items. Items
+        without any rows (because they were deleted) are removed.
+        """
+        for item_id in item_ids:
+            for token in self._tokens_by_item.pop(item_id, ()):
+                postings = self._postings[token]
+                del postings[item_id]
+
+                if not postings:
+                    del self._postings[token]
+                    del self._tokens[bisect.bisect_left(self._tokens, token)]
+
+        for row in rows:
+            self._add_row(row)
+
+        for token in self._postings.keys() - set(self._tokens):
+            bisect.insort(self._tokens, token)
+
+    def _match_token(self, query_token: str) -> Dict[int, float]:
+        """
+        Returns the score of every item containing a token that starts with
+        "query_token". Whole word matches score higher than prefix matches.
+        """
+        scores = {}
+        index = bisect.bisect_left(self._tokens, query_token)
+
+        while index < len(self._tokens) and self._tokens[index].startswith(query_token):
+            token = self._tokens[index]
+            weight = 1.0 if token == query_token else PREFIX_WEIGHT
+
+            for item_id, score in self._postings[token].items():
+                scores[item_id] = max(scores.get(item_id, 0), score * weight)
+
+            index += 1
+
+        return scores
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[int]:
+        """
+        Returns the IDs of items that match every token in "query", ordered
+        from the best match to the worst. An empty query matches every item.
+        """
+        query_tokens = tokenize(query)
+
+        if not query_tokens:
+            item_ids = sorted(self._tokens_by_item)
+            return item_ids[:limit] if limit else item_ids
+
+        totals = None
+
+        for query_token in set(query_tokens):
+            scores = self._match_token(query_token)
+
+            if totals is None:
+                totals = scores
+            else:
+                totals = {
+                    item_id: total + scores[item_id]
+                    for item_id, total in totals.items()
+                    if item_id in scores
+                }
+
+            if not totals:
+                return []
+
+        ranked = sorted(totals, key=lambda item_id: (-totals[item_id], item_id))
+
+        return ranked[:limit] if limit else ranked
+
+
+_index = None
+
+# How far into the change log the search index has read
+_change_position = None
+
+# Only one request loads rows into the index at a time. The others wait for it
+# instead of all running the same queries at once. See get_lock for why this
+# isn't created when the module is imported.
+_lock = None
+_lock_pid = None
+# Only held while creating _lock, so it never blocks for long
+_lock_guard = threading.Lock()
+
+
+def get_lock():
+    """
+    Returns the lock that serialises loading rows into the index, creating it
+    the first time it's needed in each process. The app is imported before
+    gunicorn forks its workers, and gevent workers only monkey-patch threading
+    after that. A lock created on import would be a real lock, and a greenlet
+    blocking on it while another one waits on the database would block the
+    whole worker. Created here, it's a gevent lock that only blocks the
+    greenlet waiting for it.
+    """
+    global _lock, _lock_pid
+
+    with _lock_guard:
+        if _lock is None or _lock_pid != os.getpid():
+            _lock = threading.Lock()
+            _lock_pid = os.getpid()
+
+        return _lock
+
+
+class ItemSearch:
+    """
+    Keeps a SearchIndex for this worker. The index is built from the whole
+    itemChild table the first time it's searched. After that, only the items
+    recorded in ItemChanges since the last search are reloaded.
+    """
+
+    @staticmethod
+    def search(
+        query: str,
+        load_rows: Callable[[Optional[List[int]]], Optional[List[dict]]],
+        limit: Optional[int] = None,
+    ) -> Optional[List[int]]:
+        """
+        Searches the index, calling "load_rows" with the IDs of the items whose
+        itemChild rows need to be (re)indexed, or None if every row is needed.
+        Returns None if the rows couldn't be loaded.
+        """
+        global _index, _change_position
+
+        with get_lock():
+            # Changes are recorded after they're committed, so reading the
+            # change log before loading the rows means no change can be missed
+            if _index is None:
+                position, item_ids = ItemChanges.position(), None
+            else:
+                position, item_ids = ItemChanges.since(_change_position)
+
+            if item_ids is None:
+                rows = load_rows(None)
+
+                if rows is None:
+                    return None
+
+                _index = SearchIndex(rows)
+            elif item_ids:
+                item_ids = sorted(set(item_ids))
+                rows = load_rows(item_ids)
+
+                if rows is None:
+                    return None
+
+                _index.update_items(item_ids, rows)
+
+            _change_position = position
+
+            return _index.search(query, limit)
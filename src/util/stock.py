@@ -0,0 +1,39 @@
+"""
+Keeps track of how many units of an item are on the shelf. The quantity and
+availability of an item are always changed together in a single conditional
+UPDATE so concurrent requests can't drive the quantity below 0 or leave the
+item available with nothing left in stock.
+"""
+
+# Reservations with these statuses have a unit of their item off the shelf
+CHECKED_OUT_STATUSES = {"checked out", "late"}
+
+# MySQL applies assignments from left to right, so "available" is derived
+# from the quantity after it's been changed
+CHECK_OUT_QUERY = """
+    UPDATE item
+    SET quantity = quantity - 1, available = quantity > 0
+    WHERE ID = %s AND quantity > 0
+"""
+
+RETURN_QUERY = """
+    UPDATE item
+    SET quantity = quantity + 1, available = quantity > 0
+    WHERE ID = %s
+"""
+
+
+def check_out_unit(cursor, item_id: int) -> bool:
+    """
+    Takes a unit of the item off the shelf. Returns False (without changing
+    anything) if there aren't any left.
+    """
+    cursor.execute(CHECK_OUT_QUERY, (item_id,))
+    return cursor.rowcount == 1
+
+
+def return_unit(cursor, item_id: int):
+    """
+    Puts a unit of the item back on the shelf
+    """
+    cursor.execute(RETURN_QUERY, (item_id,))
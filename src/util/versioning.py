@@ -0,0 +1,105 @@
+import multiprocessing
+import uuid
+
+# Identifies this run of the server. Since the counters start from 0 every time
+# the server starts, this keeps ETags from before a restart from being reused.
+_boot_id = uuid.uuid4().hex[:8]
+
+# IMPORTANT: These are created when this module is imported. Since gunicorn
+# preloads the app before forking its workers (see gunicorn.conf.py), every
+# worker shares the same counters, so a write handled by one worker is seen
+# by all of them.
+_counters = {
+    "inventory": multiprocessing.Value("Q", 0),
+    "reservations": multiprocessing.Value("Q", 0),
+    "users": multiprocessing.Value("Q", 0),
+}
+
+
+class ResourceVersions:
+    """
+    Keeps a version counter for each resource that's bumped whenever a
+    route changes that resource. Read routes use these to tell whether their
+    data could have changed without having to query the database.
+    """
+
+    @staticmethod
+    def bump(*resources: str):
+        """
+        Increments the version of every given resource. This should be
+        called after the changes to the resource have been committed.
+        """
+        for resource in resources:
+            counter = _counters[resource]
+
+            with counter.get_lock():
+                counter.value += 1
+
+    @staticmethod
+    def get(resource: str) -> int:
+        return _counters[resource].value
+
+    @staticmethod
+    def etag(*resources: str) -> str:
+        """
+        Creates an ETag that changes whenever any of the given resources change.
+        """
+        versions = "-".join(
+            str(ResourceVersions.get(resource)) for resource in resources
+        )
+        return f"{_boot_id}-{versions}"
+
+
+class ChangeLog:
+    """
+    A ring buffer of the IDs of recently changed rows that's shared between
+    workers the same way the counters above are. Caches holding individual rows
+    use this to invalidate exactly the rows that changed instead of everything.
+    """
+
+    def __init__(self, size=4096):
+        self._size = size
+        self._ids = multiprocessing.Array("q", size, lock=False)
+        self._count = multiprocessing.Value("Q", 0)
+
+    def record(self, *ids: int):
+        """
+        Records that the rows with the given IDs changed. Like
+        ResourceVersions.bump, this should be called after the changes have
+        been committed.
+        """
+        with self._count.get_lock():
+            for row_id in ids:
+                if row_id is None:
+                    continue
+
+                self._ids[self._count.value % self._size] = row_id
+                self._count.value += 1
+
+    def position(self) -> int:
+        return self._count.value
+
+    def since(self, position: int):
+        """
+        Returns the current position in the change log along with the IDs of the
+        rows changed after "position". If so many rows have changed since then
+        that some were overwritten, the list of IDs will be None instead.
+        """
+        current = self._count.value
+
+        if current - position > self._size:
+            return current, None
+
+        ids = [self._ids[index % self._size] for index in range(position, current)]
+
+        return current, ids
+
+
+# Like the counters above, these are created when this module is imported so
+# every worker shares them
+
+# IDs (from the item table) of items that changed
+ItemChanges = ChangeLog()
+
+# IDs of users whose reservations changed
+UserReservationChanges = ChangeLog()